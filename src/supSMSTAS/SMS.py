@@ -0,0 +1,586 @@
+# SPDX-License-Identifier: GPL-3.0-only
+# Copyright (c) 2022 sup39
+
+import os
+import json
+import zlib
+import mmap
+import threading
+import numpy as np
+from numpy import array
+from collections import OrderedDict
+from dolphin.memorylib import Dolphin
+from .WFC import SurfaceTable
+from .shape import AABBGrid
+from .timing import span
+
+# MEM1
+MEM1_BASE = 0x8000_0000
+MEM1_SIZE = 0x0180_0000
+
+# TBGCheckData
+CHECK_DATA_SIZE = 0x44
+CHECK_DATA_DTYPE = np.dtype({
+  'names': ['type', 'para', 'trntype', 'unk7', 'verts', 'n', 'c'],
+  'formats': ['>u2', '>u2', 'u1', 'u1', ('>f4', (3, 3)), ('>f4', (3,)), '>f4'],
+  'offsets': [0x00, 0x02, 0x04, 0x05, 0x10, 0x34, 0x40],
+  'itemsize': CHECK_DATA_SIZE,
+})
+# TBGCheckListRoot = TBGCheckListWarp[3] (ground, roof, wall)
+CHECK_LIST_ROOT_SIZE = 36
+CHECK_LIST_WARP_SIZE = 12
+CHECK_LIST_KINDS = ('ground', 'roof', 'wall')
+# size of TMario to watch when no frame counter symbol is known
+MARIO_SIGNATURE_SIZE = 0x100
+# max distance between a triangle and its hitboxs
+HITBOX_MARGIN = 200
+
+# symbol tables
+## built-in table, and tables of users (separated by os.pathsep)
+SYMBOLS_PATH = os.path.join(os.path.dirname(__file__), 'symbols.json')
+USER_SYMBOLS_ENV = 'SUPSMSTAS_SYMBOLS'
+
+def versionID(gameID, disc=0, revision=0):
+  '''
+  MEM1の先頭8バイト(ゲームID、ディスク番号、リビジョン)
+  First 8 bytes of MEM1 (game ID, disc number, revision)
+  '''
+  return gameID.encode()+bytes([disc, revision])
+def versionName(verID):
+  return '%s (disc %d, rev %d)'%(verID[:6].decode(errors='replace'), verID[6], verID[7])
+
+def load_symbols(path, symbols=None, names=None):
+  '''
+  JSONのシンボル表を読み込み、symbolsとnamesに加える
+  Load symbol table in JSON, and add it to symbols and names
+  * path:
+    [{"id": "GMSJ01", "disc": 0, "revision": 0, "name": "NTSC-J 1.0",
+      "symbols": {"gpMap": "0x8040A570", ...}}, ...]
+  * symbols: version ID -> {symbol -> address}
+  * names: version ID -> name of the version
+  * returns: (symbols, names)
+  '''
+  symbols = {} if symbols is None else symbols
+  names = {} if names is None else names
+  with open(path) as f:
+    entries = json.load(f)
+  for entry in entries:
+    verID = versionID(entry['id'], entry.get('disc', 0), entry.get('revision', 0))
+    table = symbols.setdefault(verID, {})
+    for name, addr in entry.get('symbols', {}).items():
+      table[name] = int(addr, 0) if isinstance(addr, str) else int(addr)
+    if 'name' in entry: names[verID] = entry['name']
+  return symbols, names
+def default_symbols():
+  '''
+  組み込みの表と、環境変数SUPSMSTAS_SYMBOLSのファイルの表を読み込む
+  Load the built-in table and the tables in files of environment variable SUPSMSTAS_SYMBOLS
+  '''
+  symbols, names = load_symbols(SYMBOLS_PATH)
+  for path in os.environ.get(USER_SYMBOLS_ENV, '').split(os.pathsep):
+    if path: load_symbols(path, symbols, names)
+  return symbols, names
+
+class SMSDolphin(Dolphin):
+  # version ID -> {symbol -> address}, version ID -> name
+  symbols, versionNames = default_symbols()
+  # whether write_*() is unavailable (e.g. SessionReplay)
+  readOnly = False
+  def get_symb_addr(self, name): # override
+    return self.symbolTable[name]
+  def try_resolve_addr(self, addr): # override
+    # resolved addresses are cached only between beginFrame() and endFrame() of this thread
+    pointers = getattr(self.frameLocal, 'pointers', None)
+    if pointers is not None:
+      try: return pointers[addr]
+      except KeyError: pass
+      except TypeError: pointers = None # not hashable
+    with span('pointer'):
+      ans = super().try_resolve_addr(addr)
+    if pointers is not None: pointers[addr] = ans
+    return ans
+  def invalidatePointers(self):
+    '''
+    キャッシュしたポインタの解決結果を捨てる
+    Drop cached results of pointer resolution
+    '''
+    pointers = getattr(self.frameLocal, 'pointers', None)
+    if pointers is not None: pointers.clear()
+  def beginFrame(self):
+    '''
+    このスレッドでendFrame()までポインタの解決結果をキャッシュする
+    (ゲームはその間に進まないものとする。それ以外では毎回解決する)
+    Cache results of pointer resolution in this thread until endFrame()
+    (assuming the game does not advance meanwhile; resolved every time otherwise)
+    '''
+    self.frameLocal.pointers = {}
+  def endFrame(self):
+    self.frameLocal.pointers = None
+
+  def __init__(self):
+    super().__init__()
+    self.hooked = False
+    self.mem8 = self.mem32 = None
+    self.verID = None
+    self.symbolTable = {}
+    self.frameLocal = threading.local()
+    self.colCache = CheckDataCache()
+  @classmethod
+  def loadSymbols(cls, path):
+    '''
+    JSONのシンボル表を加える (See load_symbols())
+    Add symbol table in JSON (See load_symbols())
+    '''
+    load_symbols(path, cls.symbols, cls.versionNames)
+  def hook(self, *args, **kwargs):
+    self.hooked = False
+    self.mem8 = self.mem32 = None
+    self.invalidatePointers()
+    self.colCache.clear()
+    if super().hook(*args, **kwargs) is None:
+      return 'SMS is not running'
+    return self.attach(self.memory)
+  def attach(self, memory):
+    '''
+    Dolphinの代わりにメモリ(bufにMEM1を持つオブジェクト)を使う
+    Use memory (object whose buf is MEM1) instead of Dolphin
+    * returns: error message or None
+    '''
+    self.hooked = False
+    self.mem8 = self.mem32 = None
+    self.invalidatePointers()
+    self.colCache.clear()
+    self.memory = memory
+    # check game (resolved only once)
+    verID = self.verID = self.memory.buf[:8].tobytes()
+    self.symbolTable = SMSDolphin.symbols.get(verID, {})
+    if verID[:3] != b'GMS':
+      return 'Current game is not SMS'
+    if verID not in SMSDolphin.symbols:
+      return 'No symbols of %s (supported: %s; add them by %s)'%(
+        versionName(verID), ', '.join(SMSDolphin.versionNames.values()), USER_SYMBOLS_ENV)
+    # zero-copy views of MEM1
+    self.mem8 = np.frombuffer(self.memory.buf, 'u1', count=MEM1_SIZE)
+    self.mem32 = self.mem8.view('>u4')
+    self.hooked = True
+
+  def readFrameSignature(self):
+    '''
+    ゲームのフレームが進むと変わる値を返す
+    frameCounterのシンボルがなければ、TMarioのデータとdynamic collisionのCRC32を返す
+    (マリオが止まっていても動く床は描き直す)
+    Return a value that changes when the game advances.
+    If no symbol of frameCounter is known, return CRC32 of the data of TMario
+    and dynamic collision (so that moving platforms are redrawn even if Mario stays still)
+    '''
+    # the game may have advanced
+    self.invalidatePointers()
+    if 'frameCounter' in self.symbolTable:
+      return self.read_uint32(('frameCounter',))
+    data = self.read_bytes(('gpMarioOriginal', 0), MARIO_SIGNATURE_SIZE)
+    colInfo = self.read_struct(('gpMap', 0x10, 0), '>ffII4xII')
+    if data is None or colInfo is None: return None
+    return zlib.crc32(data), self.readDynamicSignature(colInfo)
+  def readDynamicSignature(self, colInfo):
+    '''
+    dynamic TBGCheckListRoot配列(リストの先頭)と、登録された三角形の頂点のCRC32
+    CRC32 of dynamic TBGCheckListRoot array (heads of lists)
+    and vertices of the registered triangles
+    '''
+    xBlockCount, zBlockCount, _, ptrDyCLR = colInfo[2:]
+    i0 = (ptrDyCLR-MEM1_BASE)>>2
+    roots = self.mem32[i0:i0+xBlockCount*zBlockCount*(CHECK_LIST_ROOT_SIZE>>2)]
+    # head of each TBGCheckListWarp (ground, roof, wall)
+    heads = roots.reshape(-1, CHECK_LIST_ROOT_SIZE>>2)[:,1::CHECK_LIST_WARP_SIZE>>2]
+    addrs = []
+    for head in heads[heads != 0].tolist(): addrs += self.walkCheckList(head)
+    h = zlib.crc32(roots.tobytes())
+    if len(addrs):
+      # only vertices (9 words at +0x10), duplicates included
+      idx = (array(addrs, 'i8')+0x10-MEM1_BASE)>>2
+      h = zlib.crc32(self.mem32[idx[:,None]+np.arange(9)].tobytes(), h)
+    return h
+
+  def readStageKey(self, colInfo):
+    '''
+    ステージが変わると変わる値を返す
+    gpMap、collisionのヘッダ、static TBGCheckListRoot配列のチェックサム
+    Return a value that changes when the stage changes:
+    gpMap, collision header, and checksum of static TBGCheckListRoot array
+    '''
+    xBlockCount, zBlockCount, ptrStCLR = colInfo[2:5]
+    i0 = ptrStCLR-MEM1_BASE
+    return (
+      self.read_uint32(('gpMap',)), tuple(colInfo),
+      zlib.crc32(self.mem8[i0:i0+xBlockCount*zBlockCount*CHECK_LIST_ROOT_SIZE]),
+    )
+  def walkCheckList(self, ptr):
+    '''
+    TBGCheckListをたどり、三角形のアドレスを返す
+    Walk a TBGCheckList and return the addresses of its triangles
+    '''
+    mem32 = self.mem32
+    ans = []
+    while ptr:
+      # node: (vtable?, next, data)
+      idx = (ptr-MEM1_BASE)>>2
+      ptr, data = int(mem32[idx+1]), int(mem32[idx+2])
+      ans.append(data)
+    return ans
+  def readCheckData(self, addrs):
+    '''
+    三角形のアドレスの配列からTBGCheckDataを一括で読み込む
+    Read TBGCheckData of all addresses at once
+    * returns: structured array of CHECK_DATA_DTYPE
+    '''
+    offs = np.asarray(addrs, 'i8')-MEM1_BASE
+    raw = self.mem8[offs[:,None]+np.arange(CHECK_DATA_SIZE)]
+    return raw.view(CHECK_DATA_DTYPE).reshape(-1)
+  def readCheckLists(self, ptrCLRs, colOff, withData=True):
+    '''
+    各TBGCheckListRootの(ground, roof, wall)を一括で読み込む
+    Read (ground, roof, wall) lists of each TBGCheckListRoot at once
+    * ptrCLRs:
+      TBGCheckListRoot配列のアドレス(static, dynamic)
+      Addresses of TBGCheckListRoot arrays (static, dynamic)
+    * colOff:
+      ブロックのオフセット
+      Offset of the block
+    * withData:
+      TBGCheckDataも読み込むか
+      Whether to read TBGCheckData as well
+    * returns: (addrs, kinds, data)
+      kinds: index of CHECK_LIST_KINDS
+      data: None if not withData
+    '''
+    addrs, kinds = [], []
+    for ptrCLR in ptrCLRs:
+      head = (ptrCLR+colOff+4-MEM1_BASE)>>2
+      for j in range(len(CHECK_LIST_KINDS)):
+        tris = self.walkCheckList(int(self.mem32[head+3*j]))
+        addrs += tris
+        kinds += [j]*len(tris)
+    addrs = array(addrs, 'u4')
+    return addrs, array(kinds, 'u1'), self.readCheckData(addrs) if withData else None
+
+  def getCheckLists(self, colInfo, colOff):
+    '''
+    ブロックの(ground, roof, wall)のSurfaceTableを返す
+    staticはステージが変わるまでキャッシュし、dynamicは毎回読み込む
+    Return SurfaceTables of (ground, roof, wall) in the block.
+    Static collision is cached until the stage changes,
+    and dynamic collision is read every time
+    * colInfo:
+      (xLimit, zLimit, xBlockCount, zBlockCount, ptrStCLR, ptrDyCLR)
+    * colOff:
+      ブロックのオフセット
+      Offset of the block
+    '''
+    return self.getCheckListsAt(colInfo, [colOff])
+  def getCheckListsInRect(self, colInfo, xMin, zMin, xMax, zMax):
+    '''
+    矩形 [xMin, xMax]×[zMin, zMax] と重なる全てのブロックの
+    (ground, roof, wall)のSurfaceTableを返す
+    Return SurfaceTables of (ground, roof, wall)
+    in all blocks overlapping the rectangle [xMin, xMax]×[zMin, zMax]
+    '''
+    return self.getCheckListsAt(colInfo, blockOffsetsInRect(colInfo, xMin, zMin, xMax, zMax))
+  def getCheckListsAt(self, colInfo, colOffs):
+    '''
+    複数のブロックの(ground, roof, wall)のSurfaceTableを返す
+    複数のブロックに登録された三角形はアドレスで重複を除く
+    Return SurfaceTables of (ground, roof, wall) in the blocks.
+    Triangles registered in several blocks are deduplicated by address
+    '''
+    return [
+      st+dy for st, dy in zip(
+        self.getStaticListsAt(colInfo, colOffs),
+        self.getDynamicListsAt(colInfo, colOffs),
+      )
+    ]
+  def getStaticListsAt(self, colInfo, colOffs):
+    ptrStCLR = colInfo[4]
+    cache = self.colCache
+    with span('collision'):
+      cache.validate(self, colInfo)
+      addrss = [cache.getCellAddrs(self, ptrStCLR, colOff) for colOff in colOffs]
+      return [
+        cache.getSurfaces(self, uniqueAddrs([addrs[j] for addrs in addrss]))
+        for j in range(len(CHECK_LIST_KINDS))
+      ]
+  def getDynamicListsAt(self, colInfo, colOffs):
+    _, kinds, data = self.getDynamicDataAt(colInfo, colOffs)
+    return [
+      checkData2table(data[kinds==j])
+      for j in range(len(CHECK_LIST_KINDS))
+    ]
+  def getDynamicDataAt(self, colInfo, colOffs):
+    '''
+    複数のブロックのdynamic collisionを読み込む(アドレスで重複を除く)
+    Read dynamic collision of the blocks (deduplicated by address)
+    * returns: (addrs, kinds, data)
+      See `readCheckLists()`
+    '''
+    ptrDyCLR = colInfo[5]
+    addrss, kindss = [], []
+    with span('collision'):
+      for colOff in colOffs:
+        addrs, kinds, _ = self.readCheckLists([ptrDyCLR], colOff, withData=False)
+        addrss.append(addrs)
+        kindss.append(kinds)
+      addrs = np.concatenate(addrss) if len(addrss) else np.zeros(0, 'u4')
+      kinds = np.concatenate(kindss) if len(kindss) else np.zeros(0, 'u1')
+      _, idx = np.unique(addrs, return_index=True)
+      idx.sort()
+      return addrs[idx], kinds[idx], self.readCheckData(addrs[idx])
+
+  def getStageSnapshot(self, colInfo):
+    '''
+    現在のステージのStageSnapshotを返す(ステージが変わるまでキャッシュする)
+    Return StageSnapshot of current stage (cached until the stage changes)
+    '''
+    cache = self.colCache
+    with span('collision'):
+      cache.validate(self, colInfo)
+      if cache.snapshot is None:
+        cache.snapshot = self.loadStageSnapshot(colInfo)
+    return cache.snapshot
+  def loadStageSnapshot(self, colInfo):
+    '''
+    全てのブロックのstatic collisionを読み込む
+    Load static collision of all blocks
+    '''
+    xBlockCount, zBlockCount, ptrStCLR = colInfo[2:5]
+    addrs, kinds = [], []
+    for colOff in range(0, xBlockCount*zBlockCount*CHECK_LIST_ROOT_SIZE, CHECK_LIST_ROOT_SIZE):
+      a, k, _ = self.readCheckLists([ptrStCLR], colOff, withData=False)
+      addrs.append(a)
+      kinds.append(k)
+    addrs = np.concatenate(addrs) if len(addrs) else np.zeros(0, 'u4')
+    kinds = np.concatenate(kinds) if len(kinds) else np.zeros(0, 'u1')
+    # deduplicate by address
+    _, idx = np.unique(addrs, return_index=True)
+    addrs, kinds = addrs[idx], kinds[idx]
+    return StageSnapshot(addrs, kinds, self.readCheckData(addrs))
+
+  def checkList2list(self, ptr):
+    return checkData2list(self.readCheckData(self.walkCheckList(ptr)))
+
+class MemoryDump:
+  '''
+  MEM1のダンプファイルをmmapし、Dolphinの共有メモリの代わりに使う
+  書き込みはメモリ上だけで、ファイルには反映されない
+  Memory-mapped dump file of MEM1, used instead of shared memory of Dolphin.
+  Writes only change the memory, not the file
+  * path: path of the dump file (MEM1_SIZE bytes)
+  '''
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    if len(self.mm) < MEM1_SIZE:
+      self.mm.close()
+      raise ValueError('Not a dump of MEM1: %s'%path)
+    self.buf = memoryview(self.mm)[:MEM1_SIZE]
+    self.path = path
+  def __repr__(self):
+    return 'MemoryDump of %s'%self.path
+
+class DumpDolphin(SMSDolphin):
+  '''
+  Dolphinの代わりにMEM1のダンプファイルを読み込むSMSDolphin
+  SMSDolphin reading a dump file of MEM1 instead of Dolphin
+  * path: path of the dump file
+  '''
+  def __init__(self, path):
+    super().__init__()
+    self.path = path
+  def hook(self, *args, **kwargs):
+    self.hooked = False
+    self.mem8 = self.mem32 = None
+    try: memory = MemoryDump(self.path)
+    except (OSError, ValueError) as e: return str(e)
+    return self.attach(memory)
+
+def dump_memory(d, path):
+  '''
+  MEM1をファイルに保存する (DumpDolphinで読み込める)
+  Save MEM1 to a file (can be loaded by DumpDolphin)
+  '''
+  with open(path, 'wb') as f:
+    f.write(d.memory.buf[:MEM1_SIZE])
+
+def blockOffsetsInRect(colInfo, xMin, zMin, xMax, zMax):
+  '''
+  矩形 [xMin, xMax]×[zMin, zMax] と重なるブロックのオフセットを返す
+  Return offsets of blocks overlapping the rectangle [xMin, xMax]×[zMin, zMax]
+  '''
+  xLimit, zLimit, xBlockCount, zBlockCount = colInfo[:4]
+  ix0, ix1 = (max(0, int((x+xLimit)//1024)) for x in (xMin, xMax))
+  iz0, iz1 = (max(0, int((z+zLimit)//1024)) for z in (zMin, zMax))
+  ix1, iz1 = min(ix1, xBlockCount-1), min(iz1, zBlockCount-1)
+  return [
+    (iz*xBlockCount+ix)*CHECK_LIST_ROOT_SIZE
+    for iz in range(iz0, iz1+1)
+    for ix in range(ix0, ix1+1)
+  ]
+
+def uniqueAddrs(addrss):
+  '''
+  アドレスの配列を連結し、最初の出現順に重複を除く
+  Concatenate arrays of addresses and remove duplicates (keep first occurrence)
+  '''
+  addrs = np.concatenate(addrss) if len(addrss) else np.zeros(0, 'u4')
+  _, idx = np.unique(addrs, return_index=True)
+  return addrs[np.sort(idx)]
+
+def checkData2table(data):
+  '''
+  TBGCheckDataの構造化配列をSurfaceTableに変換する
+  Convert structured array of TBGCheckData to SurfaceTable
+  '''
+  return SurfaceTable(
+    data['type'], data['para'], data['trntype'], data['unk7'],
+    data['verts'].astype('f'), data['n'].astype('f'), data['c'].astype('f'),
+  )
+def checkData2list(data):
+  '''
+  TBGCheckDataの構造化配列をSurface(SurfaceView)のリストに変換する
+  Convert structured array of TBGCheckData to list of Surface (SurfaceView)
+  '''
+  return list(checkData2table(data))
+
+class CheckDataCache:
+  '''
+  static collisionのキャッシュ
+  Cache of static collision
+  * cells:
+    ブロックのオフセット -> 各リストの三角形のアドレス (LRU)
+    Offset of block -> addresses of triangles of each list (LRU)
+  * surfaces, slots, lastUsed:
+    読み込んだ三角形のSurfaceTableと、アドレス -> 行番号、各行の最終使用時刻 (LRU)
+    SurfaceTable of loaded triangles, address -> row, and last used tick of each row (LRU)
+  * snapshot:
+    ステージ全体のStageSnapshot (読み込んだ場合)
+    StageSnapshot of the whole stage (if loaded)
+  '''
+  def __init__(self, maxCells=4096, maxSurfaces=65536):
+    self.maxCells = maxCells
+    self.maxSurfaces = maxSurfaces
+    self.stageKey = None
+    self.snapshot = None
+    self.cells = OrderedDict()
+    self.clearSurfaces()
+  def clear(self):
+    self.stageKey = None
+    self.snapshot = None
+    self.cells.clear()
+    self.clearSurfaces()
+  def clearSurfaces(self):
+    self.surfaces = SurfaceTable.empty()
+    self.addrs = np.zeros(0, 'u4')
+    self.slots = {}
+    self.lastUsed = np.zeros(0, 'i8')
+    self.tick = 0
+  def validate(self, d, colInfo):
+    '''
+    ステージが変わった場合はキャッシュを破棄する
+    Drop the cache if the stage has changed
+    '''
+    key = d.readStageKey(colInfo)
+    if key != self.stageKey:
+      self.clear()
+      self.stageKey = key
+  def getCellAddrs(self, d, ptrCLR, colOff):
+    '''
+    ブロックの(ground, roof, wall)の三角形のアドレスを返す
+    Return addresses of triangles of (ground, roof, wall) in the block
+    '''
+    cells = self.cells
+    addrss = cells.get(colOff)
+    if addrss is None:
+      addrs, kinds, _ = d.readCheckLists([ptrCLR], colOff, withData=False)
+      addrss = cells[colOff] = [addrs[kinds==j] for j in range(len(CHECK_LIST_KINDS))]
+      if len(cells) > self.maxCells: cells.popitem(last=False)
+    else:
+      cells.move_to_end(colOff)
+    return addrss
+  def getSurfaces(self, d, addrs):
+    '''
+    アドレスの配列に対応するSurfaceTableを返す
+    Return SurfaceTable at the addresses
+    '''
+    self.tick += 1
+    slots = self.slots
+    rows = np.array([slots.get(addr, -1) for addr in addrs.tolist()], 'i8')
+    # decode missing surfaces at once
+    miss = rows < 0
+    if miss.any():
+      newAddrs = uniqueAddrs([addrs[miss]])
+      n0 = len(self.addrs)
+      self.surfaces = self.surfaces+checkData2table(d.readCheckData(newAddrs))
+      self.addrs = np.concatenate([self.addrs, newAddrs])
+      self.lastUsed = np.concatenate([self.lastUsed, np.zeros(len(newAddrs), 'i8')])
+      for i, addr in enumerate(newAddrs.tolist(), n0): slots[addr] = i
+      rows[miss] = [slots[addr] for addr in addrs[miss].tolist()]
+    self.lastUsed[rows] = self.tick
+    ans = self.surfaces.take(rows)
+    if len(self.addrs) > self.maxSurfaces: self.evictSurfaces()
+    return ans
+  def evictSurfaces(self):
+    '''
+    古い三角形を捨て、maxSurfacesの半分まで減らす
+    Drop least recently used triangles down to half of maxSurfaces
+    '''
+    keep = np.sort(np.argsort(-self.lastUsed, kind='stable')[:self.maxSurfaces//2])
+    self.surfaces = self.surfaces.take(keep)
+    self.addrs = self.addrs[keep]
+    self.lastUsed = self.lastUsed[keep]
+    self.slots = {addr: i for i, addr in enumerate(self.addrs.tolist())}
+
+class StageSnapshot:
+  '''
+  ステージ全体のstatic collisionと、その空間インデックス
+  Static collision of the whole stage and its spatial index
+  * addrs, kinds, data:
+    See `SMSDolphin.readCheckLists()`
+  * surfaces:
+    SurfaceTable
+  * index:
+    hitboxのAABB(三角形のAABBをHITBOX_MARGINだけ広げたもの)のAABBGrid
+    AABBGrid of hitbox AABBs (triangle AABBs extended by HITBOX_MARGIN)
+  '''
+  def __init__(self, addrs, kinds, data, margin=HITBOX_MARGIN):
+    self.addrs = addrs
+    self.kinds = kinds
+    self.data = data
+    self.surfaces = checkData2table(data)
+    verts = data['verts'].astype('d')
+    self.index = AABBGrid(verts.min(axis=1)-margin, verts.max(axis=1)+margin)
+  def __len__(self):
+    return len(self.addrs)
+  def select(self, ids):
+    '''
+    番号の三角形を(ground, roof, wall)のSurfaceTableに分ける
+    Split triangles of the indices into SurfaceTables of (ground, roof, wall)
+    '''
+    ids = np.sort(ids)
+    kinds = self.kinds[ids]
+    return [
+      self.surfaces.take(ids[kinds==j])
+      for j in range(len(CHECK_LIST_KINDS))
+    ]
+  def queryRect(self, xMin, zMin, xMax, zMax):
+    '''
+    hitboxが矩形 [xMin, xMax]×[zMin, zMax] と重なりうる三角形を返す
+    Return triangles whose hitboxs may overlap the rectangle [xMin, xMax]×[zMin, zMax]
+    '''
+    with span('collision'):
+      return self.select(self.index.queryBox((xMin, -np.inf, zMin), (xMax, np.inf, zMax)))
+  def queryPoint(self, p):
+    '''
+    hitboxが点pを含みうる三角形を返す
+    Return triangles whose hitboxs may contain point p
+    '''
+    return self.select(self.index.queryPoints([p])[1])
+  def __repr__(self):
+    return 'StageSnapshot with %d triangles'%len(self)
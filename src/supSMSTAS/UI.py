@@ -5,13 +5,11 @@ import os
 import time
 ## numpy
 import numpy as np
-from numpy import array
 ## matplotlib
 import matplotlib as mpl
 mpl.use('Qt5Agg')
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
 from matplotlib.figure import Figure
-import matplotlib.patches as patches
 ## PyQt5
 from PyQt5.QtCore import *
 from PyQt5.QtWidgets import *
@@ -19,6 +17,9 @@ from PyQt5.QtWidgets import *
 import logging
 ## local
 from .WFC import *
+from .SMS import SMSDolphin
+from .pipeline import WFCParams, WFCCache, WFCWorker, FrameWatcher, compute_frame, MULTI_HEIGHTS
+from .timing import PROFILER
 
 # add TRACE
 logging.TRACE = 5
@@ -30,6 +31,11 @@ logging.Logger.trace = trace
 # logger
 logger = logging.getLogger('supSMSTAS')
 
+# tracking Mario: half size of the view,
+# and distance from the center of the view to re-center it
+TRACK_RANGE = 1000
+TRACK_MARGIN = 500
+
 # widgets utils
 def layoutAddItem(ll, w):
   if w is None: ll.addStretch()
@@ -51,47 +57,61 @@ class MPLCanvas(FigureCanvasQTAgg):
       fig.add_subplot(121),
       fig.add_subplot(122),
     ]
+    self.plots = [GeoPlot(ax) for ax in self.axs]
+    # extra horizontal slices overlaid on the x-z plot
+    self.layerPlots = []
     super().__init__(fig)
+    # layout only when resized
+    self.mpl_connect('resize_event', lambda evt: fig.tight_layout())
+    fig.tight_layout()
+    # blitting
+    self.useBlit = False
+    self.background = None
+    self.mpl_connect('draw_event', self._onDraw)
+  def setBlit(self, useBlit):
+    self.useBlit = useBlit
+    self.background = None
+    for plot in self.layerPlots+self.plots: plot.setAnimated(useBlit)
+  def _onDraw(self, evt):
+    if not self.useBlit: return
+    # save background (without dynamic layers)
+    self.background = self.copy_from_bbox(self.fig.bbox)
+    self._drawAnimated()
+  def _drawAnimated(self):
+    for plot in self.layerPlots+self.plots:
+      for artist in plot.artists: plot.ax.draw_artist(artist)
+  def setLayers(self, layers):
+    '''
+    重ねて描く水平断面を更新し、全体の描画が必要かを返す
+    Update overlaid horizontal slices, and return whether a full redraw is needed
+    * layers: [(dy, make_geo_data())]
+    '''
+    full = False
+    while len(self.layerPlots) < len(layers):
+      plot = GeoPlot(self.axs[0], alpha=0.25, zorder=0.5)
+      plot.setAnimated(self.useBlit)
+      self.layerPlots.append(plot)
+      full = True
+    for plot, (_, data) in zip(self.layerPlots, layers):
+      plot.update(data, [0, 2])
+    for plot in self.layerPlots[len(layers):]:
+      plot.update([], [0, 2])
+    return full
+  def updateFrame(self, full=False):
+    '''
+    動的なレイヤーだけを描画し直す(必要なら全体を描画する)
+    Redraw only the dynamic layers (or the whole figure if needed)
+    '''
+    if full or not self.useBlit or self.background is None:
+      self.draw()
+    else:
+      self.restore_region(self.background)
+      self._drawAnimated()
+      self.blit(self.fig.bbox)
 
-# Dolphin for SMS
-from dolphin.memorylib import Dolphin
-class SMSDolphin(Dolphin):
-  symbols = { # TODO
-    b'GMSJ01\x00\x00': {
-      'gpMarioOriginal': 0x8040A378,
-      'gpMap': 0x8040A570,
-    }
-  }
-  def get_symb_addr(self, name): # override
-    verID = self.memory.buf[:8].tobytes()
-    return SMSDolphin.symbols[verID][name]
-
-  def __init__(self):
-    super().__init__()
-    self.hooked = False
-  def hook(self, *args, **kwargs):
-    self.hooked = False
-    if super().hook(*args, **kwargs) is None:
-      return 'SMS is not running'
-    # found pid -> check game
-    verID = self.memory.buf[:8].tobytes()
-    if verID[:3] != b'GMS':
-      return 'Current game is not SMS'
-    if verID not in SMSDolphin.symbols:
-      return 'Only NTSJ-1.0 is supported in this version'
-    self.hooked = True
-
-  def checkList2list(self, ptr):
-    ans = []
-    while ptr:
-      ptr, data = self.read_struct(ptr+4, '>II')
-      ans.append(Surface(
-        *self.read_struct(data, '>HHBB'),
-        array(self.read_struct(data+0x10, '>9f'), 'f').reshape(3, 3),
-        n=array(self.read_struct(data+0x34, '>3f'), 'f'),
-        c=self.read_float(data+0x40),
-      ))
-    return ans
+class FrameNotifier(QObject):
+  # emitted from the worker thread (with the worker), received in the GUI thread
+  frameReady = pyqtSignal(object)
 
 # widgets
 class WFCWidget(QWidget):
@@ -101,24 +121,53 @@ class WFCWidget(QWidget):
     self._init_state()
     self._init_layout()
   def activate(self, val):
-    # stop timer if deactivate
-    self.setFPS(self.fps) if val else self.timer.stop()
+    # stop timer and worker if deactivate
+    if val: self.setFPS(self.fps)
+    else:
+      self.timer.stop()
+      self.setWorker(False)
   def _init_state(self):
     self.trackMario = Qt.Checked
     self.showMario = Qt.Checked
     self.airborne = Qt.Checked
     self.yoshi = 0
     self.fps = 8
+    self.blit = Qt.Checked
+    self.snapshot = 0
+    self.multiHeight = 0
+    self.syncGame = 0
+    self.watcher = FrameWatcher()
+    self.wfcCache = WFCCache()
+    self.useWorker = 0
+    self.worker = None
     self.updating = False
     self.invertX = 0
     self.invertZ = 0
     self.xzAngle = 0
+    self.profile = 0
+    self.profileShown = 0
+    # WFCParams read by the worker thread (built in the GUI thread)
+    self.params = None
   def _init_layout(self):
     # timer
     timer = self.timer = QTimer()
     timer.timeout.connect(self.updatePlot)
+    # worker
+    self.notifier = FrameNotifier()
+    self.notifier.frameReady.connect(self.drawLatestFrame)
     # mcv
     self.mcv = mcv = MPLCanvas(self, width=11, height=5, dpi=100)
+    mcv.setBlit(self.blit==Qt.Checked)
+    ## profiler overlay
+    self.lbProfile = lbProfile = QLabel(mcv)
+    lbProfile.setStyleSheet('background-color: rgba(255, 255, 255, 230); font-family: monospace; padding: 4px')
+    lbProfile.move(8, 8)
+    lbProfile.hide()
+    ## the view (used when not tracking Mario) is changed by the toolbar too
+    for ax in mcv.axs:
+      for evt in ('xlim_changed', 'ylim_changed'):
+        ax.callbacks.connect(evt, lambda ax: self.refreshParams())
+    self.refreshParams()
     self.updatePlot()
     # toolbar
     toolbar = NavigationToolbar2QT(mcv, self)
@@ -126,7 +175,7 @@ class WFCWidget(QWidget):
     llbtn = QHBoxLayout()
     btn = QPushButton()
     btn.setText('Update plot')
-    btn.clicked.connect(self.updatePlot)
+    btn.clicked.connect(lambda: self.updatePlot(force=True))
     llbtn.addWidget(btn)
     # update
     lbFPS = QLabel()
@@ -147,12 +196,30 @@ class WFCWidget(QWidget):
       ('Yoshi', 'yoshi'),
       ('invert X', 'invertX'),
       ('invert Z', 'invertZ'),
+      ('Blit', 'blit'),
+      ('Whole stage', 'snapshot'),
+      ('Multi-height', 'multiHeight'),
+      ('Sync to game', 'syncGame'),
     ]:
       cb = QCheckBox()
       cb.setText(text)
       cb.setCheckState(getattr(self, attr))
-      cb.clicked.connect((lambda attr, cb: lambda: setattr(self, attr, cb.checkState()))(attr, cb))
+      cb.clicked.connect((lambda attr, cb: lambda: self.setOption(attr, cb.checkState()))(attr, cb))
       llbtn.addWidget(cb)
+    cbWorker = QCheckBox()
+    cbWorker.setText('Background')
+    cbWorker.setCheckState(self.useWorker)
+    cbWorker.clicked.connect(lambda: self.toggleWorker(cbWorker.checkState()))
+    llbtn.addWidget(cbWorker)
+    cbProfile = QCheckBox()
+    cbProfile.setText('Profile')
+    cbProfile.setCheckState(self.profile)
+    cbProfile.clicked.connect(lambda: self.toggleProfile(cbProfile.checkState()))
+    llbtn.addWidget(cbProfile)
+    btProfile = QPushButton()
+    btProfile.setText('Export profile')
+    btProfile.clicked.connect(self.exportProfile)
+    llbtn.addWidget(btProfile)
     llbtn.addStretch()
     # angle
     lbXZAngle = QLabel()
@@ -199,111 +266,160 @@ class WFCWidget(QWidget):
       self.timer.stop()
   def setFPS(self, fps):
     self.fps = fps
-    if fps == 0:
+    if self.useWorker:
+      self.timer.stop()
+      self.setWorker(True)
+      self.worker.setFPS(fps)
+    elif fps == 0:
       self.timer.stop()
     else:
       self.timer.setInterval(int(1000/fps))
       self.timer.start()
+  def setWorker(self, val):
+    '''
+    別スレッドでフレームを計算するか
+    Whether to compute frames in a worker thread
+    '''
+    if val and self.worker is None:
+      worker = self.worker = WFCWorker(self.d, lambda: self.params, fps=self.fps)
+      worker.callback = lambda: self.notifier.frameReady.emit(worker)
+      worker.watcher = self.watcher if self.syncGame else None
+      worker.start()
+    elif not val and self.worker is not None:
+      # frames of the stopped worker already queued are dropped by drawLatestFrame()
+      worker, self.worker = self.worker, None
+      worker.stop()
+      worker.join()
+  def toggleWorker(self, val):
+    self.useWorker = val
+    if not val: self.setWorker(False)
+    self.setFPS(self.fps)
+  def setOption(self, attr, val):
+    setattr(self, attr, val)
+    self.refreshParams()
+    # redraw even if the game has not advanced
+    self.watcher.reset()
+    if self.worker is not None:
+      self.worker.watcher = self.watcher if self.syncGame else None
+  def toggleProfile(self, val):
+    '''
+    フレームの段階ごとの時間を測り、表示するか
+    Whether to measure and show time of each stage of frames
+    '''
+    self.profile = val
+    PROFILER.setEnabled(val)
+    if val: PROFILER.clear()
+    self.lbProfile.setVisible(bool(val))
+  def exportProfile(self):
+    path, _ = QFileDialog.getSaveFileName(self, 'Export profile', 'profile.json', 'JSON (*.json);;CSV (*.csv)')
+    if path: PROFILER.export(path)
+  def showProfile(self, frame):
+    # update the overlay at most 4 times per second
+    t = time.time()
+    if not self.profile or t-self.profileShown < 0.25: return
+    self.profileShown = t
+    text = PROFILER.format()
+    # hitboxs kept/culled by AABB culling
+    if frame.culled is not None: text += '\n\nhitboxs  kept %d  culled %d'%frame.culled
+    self.lbProfile.setText(text)
+    self.lbProfile.adjustSize()
   def setXZAngle(self, val):
     self.xzAngle = val
+    self.refreshParams()
     #self.updatePlot()
-  def updatePlot(self):
+  def updatePlot(self, force=False):
+    if force: self.watcher.reset()
+    if self.worker is not None: return self.worker.trigger()
     if self.updating or not self.d.hooked: return
+    # skip if the game has not advanced
+    if self.syncGame and not self.watcher.changed(self.d, self.params, self.getDrawOptions()):
+      return
     self.updating = True
     try: self._updatePlot()
     except:
       import traceback
       traceback.print_exc()
     self.updating = False
+  def refreshParams(self):
+    '''
+    GUIスレッドでWFCParamsを作り直す(ワーカーはこれを読むだけ)
+    Rebuild WFCParams in the GUI thread (the worker only reads it)
+    '''
+    self.params = self.getParams()
+  def getParams(self):
+    center = views = None
+    radius = WFCParams._field_defaults['radius']
+    # cover the whole view, which is re-centered only when Mario leaves the inner area
+    if self.trackMario: radius = TRACK_RANGE+TRACK_MARGIN
+    else:
+      # inspect the center of x-z plot
+      ax = self.mcv.axs[0]
+      center = np.mean(ax.get_xlim()), np.mean(ax.get_ylim())
+      # cull hitboxs out of the current view
+      views = tuple((ax.get_xlim(), ax.get_ylim()) for ax in self.mcv.axs)
+    return WFCParams(
+      airborne=bool(self.airborne),
+      yoshi=bool(self.yoshi),
+      xzAngle=self.xzAngle,
+      radius=radius,
+      snapshot=bool(self.snapshot),
+      center=center,
+      views=views,
+      heights=MULTI_HEIGHTS if self.multiHeight else None,
+    )
   def _updatePlot(self):
-    d = self.d
-    pos = d.read_struct(('gpMarioOriginal', 0x10), '>3f')
-    if pos is None: return
-    pos = array(pos)
-    x, y, z = pos
-    # get collision data (static collision)
-    colInfo = d.read_struct(('gpMap', 0x10, 0), '>ffI4x4xII')
-    if colInfo is None: return
-    xLimit, zLimit, xBlockCount, ptrStCLR, ptrDyCLR = colInfo
-    ## TBGCheckListRoot[zBlockCount][xBlockCount]
-    colOff = int((z+zLimit)//1024*xBlockCount + (x+xLimit)//1024)*36
-    ## root->ground(12*2).next(4)
-
-    # mario
-    yoshi = self.yoshi
-    airborne = self.airborne
-    rW = 80 if yoshi else 50
-
     t0 = time.time()
-    stGnds, stRoofs, stWalls = [
-      [
-        tri
-        for ptrCLR in [ptrStCLR, ptrDyCLR]
-        for tri in d.checkList2list(d.read_uint32(ptrCLR+colOff+4+12*j))
-      ]
-      for j in range(3)
-    ]
-    hitboxs = [
-      ([
-        #(c, array((0, -1, 0)))
-        (makeRoof(tri, 82 if airborne else 2), array([0, -1, 0]))
-        for tri in stRoofs
-        #for c in makeCol(tri, airborne=airborne, yoshi=yoshi)
-      # if tri.maxY >= yMin
-      ##], 1.0, 78.0 if airborne else 158.0, '#f88e', '#800'),
-      ## FIXME: draw arrow
-      ], 1.0, 0, '#f88e', '#800'),
-      ([
-        #(c, array((0, 1, 0)))
-        (makeGround(tri, 0 if airborne else 0), array([0, 1, 0])) # TODO hG=100
-        for tri in stGnds # TODO grounded hitbox
-        #for c in makeCol(tri, airborne=airborne, yoshi=yoshi)
-      # if tri.maxY >= yMin
-      ## FIXME: draw arrow
-      ], 1.0, 0, '#88fe', '#008'), # TODO
-      *(
-        ([
-          #(c, tri.n)
-          (makeWall(tri, w, dy), tri.n)
-          for tri in stWalls
-          #for c in [makeCol(tri, airborne=airborne, yoshi=yoshi)[ii]]
-        # if tri.maxY >= yMin
-        # arrow size scale (0.5 if radius is 25)
-        ], 1.0 if airborne or ii == 1 else 0.5, rW, ['#8fcc', '#8f8c'][ii], ['#084', '#080'][ii])
-        #], 1.0 if airborne or ii == 1 else 0.5, rW, '#8f8e', '#080')
-        for ii, (w, dy) in zip((1, 0), [(rW, 30), (rW, 150)] if airborne else [(rW, 60), (rW/2, 30)])
-      ),
-    ]
-    # xzAngle
-    theta = self.xzAngle/50*np.pi
-    pnXZ = (-np.sin(theta), 0, -np.cos(theta))
-    axesXZ = [2 if abs(pnXZ[0])>abs(pnXZ[2]) else 0, 1]
+    frame = compute_frame(self.d, self.params, self.wfcCache)
+    if frame is None: return
+    with PROFILER.span('draw'):
+      self.drawFrame(frame)
+    self.showProfile(frame)
+    logger.trace('%.2f'%((time.time()-t0)*1000))
+  def drawLatestFrame(self, worker):
+    # ignore frames of stopped workers
+    if worker is not self.worker: return
+    frame = worker.buffer.take()
+    if frame is None: return
+    try:
+      with PROFILER.span('draw'):
+        self.drawFrame(frame)
+    except:
+      import traceback
+      traceback.print_exc()
+    self.showProfile(frame)
+    logger.trace('%.2f'%((time.time()-frame.time)*1000))
+  def getDrawOptions(self):
+    return self.trackMario, self.showMario, self.invertX, self.invertZ, self.blit
+  def drawFrame(self, frame):
+    pos = frame.pos
     invertX = self.invertX==Qt.Checked
     invertZ = self.invertZ==Qt.Checked
     # ax
-    xzAngle = self.xzAngle
-    for ax, (pn, axes) in zip(self.mcv.axs, [
-      ((0, 1, 0), [0, 2]),
-      (pnXZ, axesXZ),
-    ]):
-      ax.patches.clear()
-      ax.collections.clear()
-      make_geo_plot(ax, hitboxs, pos, pn, axes)
-      if self.showMario:
-        ax.add_patch(patches.Circle(pos[axes], 25, fc='red'))
+    full = False
+    if (self.blit==Qt.Checked) != self.mcv.useBlit:
+      self.mcv.setBlit(self.blit==Qt.Checked)
+      full = True
+    full |= self.mcv.setLayers(frame.layers)
+    for plot, (pn, axes, data) in zip(self.mcv.plots, frame.planes):
+      ax = plot.ax
+      full |= plot.update(data, axes)
+      plot.setMario(pos[axes] if self.showMario else None)
       if self.trackMario:
-        offs = [(-1000, 1000), (-1000, 1000), (-1000, 1000)] # TODO
-        for f, i in zip((ax.set_xlim, ax.set_ylim), axes):
+        # keep the limits (and ticks) while Mario is in the inner area
+        # so that only the dynamic layers are blitted
+        lims = ax.get_xlim(), ax.get_ylim()
+        for f, (l0, l1), i in zip((ax.set_xlim, ax.set_ylim), lims, axes):
           p = pos[i]
-          d0, d1 = offs[i]
+          d0, d1 = -TRACK_RANGE, TRACK_RANGE
           if invertX & (i==0) | invertZ & (i==2): # invert
             d0, d1 = d1, d0
-          f(p+d0, p+d1)
-      ax.grid(True)
+          if abs(p-(l0+l1)/2) > TRACK_MARGIN or l1-l0 != d1-d0:
+            f(p+d0, p+d1)
+        full |= lims != (ax.get_xlim(), ax.get_ylim())
     # apply
-    self.mcv.fig.tight_layout()
-    self.mcv.draw()
-    logger.trace('%.2f'%((time.time()-t0)*1000))
+    self.mcv.updateFrame(full)
+    # the view may have changed
+    self.refreshParams()
 
 class RuntimeWidget(QWidget):
   def __init__(self, dolphin, parent=None):
@@ -381,5 +497,7 @@ class MainWindow(QMainWindow):
     err = self.dolphin.hook()
     self.lbHook.setText('Hooked' if err is None else err)
     self.qtab.setEnabled(self.dolphin.hooked)
+    # Runtime writes to the memory
+    self.qtab.setTabEnabled(self.tidxRuntime, not self.dolphin.readOnly)
   def onTabChanged(self, index):
     self.subwWFC.activate(index==self.tidxWFC)
@@ -3,8 +3,10 @@
 
 import numpy as np
 from numpy import array
-from .shape import Polyhedron
+from .shape import Polyhedron, Polyhedra, Polygons, normalize
+from .timing import span
 from matplotlib.collections import PolyCollection
+from matplotlib.patches import Circle
 
 class Surface:
   def __init__(self, surtype, surpara, trntype, unk7, verts, vidxs=None, n=None, c=None):
@@ -21,184 +23,955 @@ class Surface:
       self.minY, self.maxY, *self.n,
     )
 
-makeTriPrism = lambda tri0, tri1: Polyhedron([
-  *tri0,
-  *tri1,
-], [
+class SurfaceTable:
+  '''
+  Surfaceの構造体配列(struct of arrays)
+  Struct of arrays of Surface
+  * surtype, surpara, trntype, unk7: (N,)
+  * verts: (N, 3, 3)
+  * n: (N, 3)
+  * c: (N,)
+  * minY, maxY: (N,)
+  * xzMin, xzMax: (N, 2)
+    x-z平面上の範囲
+    Bounds on x-z plane
+  '''
+  def __init__(self, surtype, surpara, trntype, unk7, verts, n=None, c=None):
+    self.surtype = np.asarray(surtype, 'u2')
+    self.surpara = np.asarray(surpara, 'u2')
+    self.trntype = np.asarray(trntype, 'u1')
+    self.unk7 = np.asarray(unk7, 'u1')
+    self.verts = verts = np.asarray(verts, 'f').reshape(-1, 3, 3)
+    if n is None:
+      n = np.cross(verts[:,1]-verts[:,0], verts[:,2]-verts[:,1])
+      n = n/np.linalg.norm(n, axis=1, keepdims=True)
+    self.n = np.asarray(n, 'f').reshape(-1, 3)
+    self.c = -np.einsum('ij,ij->i', verts[:,0], self.n) if c is None else np.asarray(c, 'f')
+    self.minY = verts[:,:,1].min(axis=1)
+    self.maxY = verts[:,:,1].max(axis=1)
+    self.xzMin = verts[:,:,[0, 2]].min(axis=1)
+    self.xzMax = verts[:,:,[0, 2]].max(axis=1)
+  @classmethod
+  def empty(cls):
+    return cls([], [], [], [], np.zeros((0, 3, 3), 'f'))
+  @classmethod
+  def fromSurfaces(cls, tris):
+    '''
+    Surfaceのリストから作る
+    Make from list of Surface
+    '''
+    if isinstance(tris, cls): return tris
+    if len(tris) == 0: return cls.empty()
+    return cls(
+      [tri.surtype for tri in tris], [tri.surpara for tri in tris],
+      [tri.trntype for tri in tris], [tri.unk7 for tri in tris],
+      [tri.verts for tri in tris], [tri.n for tri in tris], [tri.c for tri in tris],
+    )
+  @classmethod
+  def concat(cls, tables):
+    tables = [cls.fromSurfaces(t) for t in tables]
+    if len(tables) == 0: return cls.empty()
+    return cls._fromColumns({
+      k: np.concatenate([getattr(t, k) for t in tables])
+      for k in cls._columns
+    })
+  _columns = ('surtype', 'surpara', 'trntype', 'unk7', 'verts', 'n', 'c', 'minY', 'maxY', 'xzMin', 'xzMax')
+  @classmethod
+  def _fromColumns(cls, columns):
+    self = cls.__new__(cls)
+    for k, v in columns.items(): setattr(self, k, v)
+    return self
+  def take(self, idx):
+    '''
+    idxの行からなるSurfaceTableを返す
+    Return SurfaceTable of rows idx
+    '''
+    return self._fromColumns({k: getattr(self, k)[idx] for k in self._columns})
+  def __len__(self):
+    return len(self.verts)
+  def __getitem__(self, i):
+    if isinstance(i, (int, np.integer)):
+      if i < 0: i += len(self)
+      if not 0 <= i < len(self): raise IndexError(i)
+      return SurfaceView(self, int(i))
+    return self.take(i)
+  def __iter__(self):
+    return (SurfaceView(self, i) for i in range(len(self)))
+  def __add__(self, other):
+    return SurfaceTable.concat([self, other])
+  def __repr__(self):
+    return 'SurfaceTable with %d triangles'%len(self)
+
+class SurfaceView:
+  '''
+  SurfaceTableの1行(Surfaceと同じように使える)
+  A row of SurfaceTable (behaves like Surface)
+  '''
+  __slots__ = ('table', 'i')
+  vidxs = None
+  def __init__(self, table, i):
+    self.table, self.i = table, i
+  surtype = property(lambda self: int(self.table.surtype[self.i]))
+  surpara = property(lambda self: int(self.table.surpara[self.i]))
+  trntype = property(lambda self: int(self.table.trntype[self.i]))
+  unk7 = property(lambda self: int(self.table.unk7[self.i]))
+  verts = property(lambda self: self.table.verts[self.i])
+  n = property(lambda self: self.table.n[self.i])
+  c = property(lambda self: self.table.c[self.i])
+  minY = property(lambda self: self.table.minY[self.i])
+  maxY = property(lambda self: self.table.maxY[self.i])
+  __repr__ = Surface.__repr__
+
+triPrismEdges = array([
   (0, 1), (1, 2), (2, 0),
   (0, 3), (1, 4), (2, 5),
   (3, 4), (4, 5), (5, 3),
 ])
+makeTriPrism = lambda tri0, tri1: Polyhedron([
+  *tri0,
+  *tri1,
+], triPrismEdges)
 
 def extendTriangle(tri, axis):
-  ans = np.array(tri, 'd')
-  tri = tri[:, axis]
-  for i in [-1, 0, 1]:
-    l1, l2 = tri[i]-tri[i+1], tri[i]-tri[i-1]
-    ans[i, axis] += (l1+l2)/np.abs(np.cross(l1, l2).item())
+  return extendTriangles(tri[None], axis)[0]
+def extendTriangles(tris, axes):
+  '''
+  (N, 3, 3)の三角形の配列を、axesの2軸の平面上で広げる
+  Extend triangles (N, 3, 3) on the plane of 2 axes
+  * axes:
+    (2,) or (N, 2)
+  '''
+  tris = np.asarray(tris, 'd')
+  idx = np.broadcast_to(np.asarray(axes)[...,None,:], (len(tris), 3, 2))
+  tri = np.take_along_axis(tris, idx, axis=2)
+  # l1 = tri[i]-tri[i+1], l2 = tri[i]-tri[i-1]
+  l1 = tri-np.roll(tri, -1, axis=1)
+  l2 = tri-np.roll(tri, 1, axis=1)
+  cross = l1[...,0]*l2[...,1]-l1[...,1]*l2[...,0]
+  ans = tris.copy()
+  np.put_along_axis(ans, idx, tri+(l1+l2)/np.abs(cross)[...,None], axis=2)
   return ans
 
+# ground: edges of top face, vertical edges, and 6 edges of bottom face
+groundEdgesUncut = array([
+  (3, 4), (4, 5), (5, 3),
+  (0, 3), (1, 4), (2, 5),
+  (0, 1), (1, 2), (2, 0),
+  (0, 0), (0, 0), (0, 0), # padding
+])
 def makeGround(tri, hG=0):
-  vertsE = extendTriangle(tri.verts, [0, 2])
-  vertsLow = vertsE-(0,108,0)
-  ySlice = tri.minY-30
-  v = array(vertsLow)
-  vertsLow[:,1] = np.clip(vertsLow[:,1], a_min=ySlice, a_max=None)
-  verts = [
-    *vertsLow,
-    *(vertsE+(0,hG,0)),
-  ]
-  edges = [
-    # top face
-    (3, 4), (4, 5), (5, 3),
-    # vertical edge
-    (0, 3), (1, 4), (2, 5),
-  ]
-  r = v[:, 1]-ySlice
+  verts, edges = makeGrounds(tri.verts[None], hG)
+  verts, edges = verts[0], edges[0]
+  if edges[-1, 0] == edges[-1, 1]:
+    # bottom face is not cut
+    verts, edges = verts[:6], edges[:9]
+  return Polyhedron(verts, edges)
+def makeGrounds(tris, hG=0):
+  '''
+  (N, 3, 3)の三角形の配列からgroundのhitboxを作る
+  Make ground hitboxs from triangles (N, 3, 3)
+  * returns: (verts (N, 8, 3), edges (N, 12, 2))
+    unused verts and edges are padded with vertex 0
+  '''
+  tris = np.asarray(tris, 'd')
+  N = len(tris)
+  vertsE = extendTriangles(tris, [0, 2])
+  v = vertsE-(0,108,0)
+  ySlice = tris[...,1].min(axis=1)-30
+  vertsLow = v.copy()
+  vertsLow[...,1] = np.maximum(vertsLow[...,1], ySlice[:,None])
+  r = v[...,1]-ySlice[:,None]
   b = r>0
-  bc = b.sum()
-  if bc in [0, 3]:
-    # bottom face
-    edges += [(0, 1), (1, 2), (2, 0)]
-  else:
-    k0 = np.where(b if bc==1 else ~b)[0][0]
-    k1 = (k0+1)%3
-    k2 = (k0+2)%3
-    v0, r0 = v[k0], r[k0]
-    v1, r1 = v[k1], r[k1]
-    v2, r2 = v[k2], r[k2]
-    verts += [
+  bc = b.sum(axis=1)
+  cut = (bc==1) | (bc==2)
+  # the vertex on the other side of the slice
+  k0 = np.where((bc==1)[:,None], b, ~b).argmax(axis=1)
+  k1 = (k0+1)%3
+  k2 = (k0+2)%3
+  iN = np.arange(N)
+  v0, r0 = v[iN, k0], r[iN, k0, None]
+  v1, r1 = v[iN, k1], r[iN, k1, None]
+  v2, r2 = v[iN, k2], r[iN, k2, None]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    vCut = np.stack([
       (r1*v0-r0*v1)/(-r0+r1),
       (r2*v0-r0*v2)/(-r0+r2),
-    ]
-    edges += [
-      (k0, 6), (6, k1),
-      (k0, 7), (7, k2),
-      (k1, k2), (6, 7),
-    ]
-  poly = Polyhedron(verts, edges)
-  return poly
+    ], axis=1)
+  vCut[~cut] = vertsLow[~cut, :1]
+  verts = np.concatenate([vertsLow, vertsE+(0,hG,0), vCut], axis=1)
+  edges = np.repeat(groundEdgesUncut[None], N, axis=0)
+  k6, k7 = np.full(N, 6), np.full(N, 7)
+  edges[cut, 6:] = np.stack([
+    k0, k6, k6, k1,
+    k0, k7, k7, k2,
+    k1, k2, k6, k7,
+  ], axis=1).reshape(N, 6, 2)[cut]
+  return verts, edges
+
 def makeRoof(tri, hR=82):
-  verts = extendTriangle(tri.verts, [0, 2])
-  poly = makeTriPrism(verts-(0,hR,0), verts-(0,160,0))
-  return poly
+  verts, edges = makeRoofs(tri.verts[None], hR)
+  return Polyhedron(verts[0], edges[0])
+def makeRoofs(tris, hR=82):
+  '''
+  (N, 3, 3)の三角形の配列からroofのhitboxを作る
+  Make roof hitboxs from triangles (N, 3, 3)
+  * returns: (verts (N, 6, 3), edges (N, 9, 2))
+  '''
+  verts = extendTriangles(tris, [0, 2])
+  return makeTriPrisms(verts-(0,hR,0), verts-(0,160,0))
+
 def makeWall(tri, rW=50, dy=30):
-  n = tri.n
-  isXWall = np.abs(n[0])>0.707
-  verts = extendTriangle(tri.verts, [2 if isXWall else 0, 1]) - (0, dy, 0)
-  off = (np.abs(rW/n[0]),0,0) if isXWall else (0,0,np.abs(rW/n[2]))
-  poly = makeTriPrism(verts-off, verts+off)
-  return poly
+  verts, edges = makeWalls(tri.verts[None], tri.n[None], rW, dy)
+  return Polyhedron(verts[0], edges[0])
+def makeWalls(tris, ns, rW=50, dy=30):
+  '''
+  (N, 3, 3)の三角形の配列と法線ベクトル(N, 3)からwallのhitboxを作る
+  Make wall hitboxs from triangles (N, 3, 3) and normal vectors (N, 3)
+  * returns: (verts (N, 6, 3), edges (N, 9, 2))
+  '''
+  ns = np.asarray(ns, 'd').reshape(-1, 3)
+  isXWall = np.abs(ns[:,0])>0.707
+  axes = np.where(isXWall[:,None], [2, 1], [0, 1])
+  verts = extendTriangles(tris, axes) - (0, dy, 0)
+  off = np.zeros((len(ns), 3))
+  with np.errstate(divide='ignore'):
+    off[:,0] = np.where(isXWall, np.abs(rW/ns[:,0]), 0)
+    off[:,2] = np.where(isXWall, 0, np.abs(rW/ns[:,2]))
+  return makeTriPrisms(verts-off[:,None], verts+off[:,None])
 
-def make_geo_plot(ax, hitboxs, p0, pn, axes):
-  # paras
-  arrowWidthBase = 70
-  arrowWidthMul = 0.5
-  arrowLenMax = 200 #80
-  arrowLenTher = 200
-  arrowLenMul1 = 0.7
-  arrowLenMul2 = 0.35
-  arrowHeadLenMul = 0.3
-  arrowLenMul2off = 0.1 #0.025
-  arrowCountMax = 100
-  aw, ah = 0.2, 0.6 # width, height of bottom rect
-  arrowVerts = array([
-    [0.0,  aw],
-    [ ah,  aw],
-    [ ah, 0.5],
-    [1.0, 0.0],
-    [ ah, -.5],
-    [ ah, -aw],
-    [0.0, -aw],
-  ])
+def makeTriPrisms(tris0, tris1):
+  verts = np.concatenate([tris0, tris1], axis=1)
+  return verts, np.repeat(triPrismEdges[None], len(verts), axis=0)
 
-  # plot
-  patches = []
-  for polys, awmul, alen, facecolor, arcolor in hitboxs:
+def prismHalfSpaces(tris0, D):
+  '''
+  三角形tris0をDだけ平行移動してできる三角柱を半空間 n・x >= c の共通部分で表す
+  Represent triangular prisms made by translating tris0 by D
+  as intersection of half spaces n・x >= c
+  * tris0: (N, 3, 3)
+  * D: (N, 3)
+  * returns: (n (N, 5, 3), c (N, 5))
+    (3 sides, 2 caps). Degenerate prisms contain no point
+  '''
+  tris0 = np.asarray(tris0, 'd')
+  D = np.broadcast_to(np.asarray(D, 'd'), (len(tris0), 3))
+  p0 = tris0
+  p1 = np.roll(tris0, -1, axis=1)
+  p2 = np.roll(tris0, -2, axis=1)
+  # sides: planes containing each edge and D, facing the opposite vertex
+  ms = np.cross(p1-p0, D[:,None])
+  sides = np.einsum('nij,nij->ni', ms, p2-p0)
+  ms *= np.sign(sides)[...,None]
+  # caps: planes of tris0 and tris0+D
+  nt = np.cross(tris0[:,1]-tris0[:,0], tris0[:,2]-tris0[:,0])
+  nt *= np.sign(np.einsum('ij,ij->i', nt, D))[:,None]
+  n = np.concatenate([ms, nt[:,None], -nt[:,None]], axis=1)
+  c = np.concatenate([
+    np.einsum('nij,nij->ni', ms, p0),
+    np.einsum('ij,ij->i', nt, tris0[:,0])[:,None],
+    -np.einsum('ij,ij->i', nt, tris0[:,0]+D)[:,None],
+  ], axis=1)
+  # degenerate: no point satisfies 0 >= 1
+  bad = (sides == 0).any(axis=1) | (nt == 0).all(axis=1)
+  n[bad] = 0
+  c[bad] = 1
+  return n, c
+def roofHalfSpaces(tris, ns, hR=82):
+  '''
+  roofのhitbox (makeRoofs()) の半空間
+  Half spaces of roof hitboxs (makeRoofs())
+  * returns: (n (N, 5, 3), c (N, 5))
+  '''
+  verts = extendTriangles(tris, [0, 2])
+  return prismHalfSpaces(verts-(0,hR,0), (0,hR-160,0))
+def groundHalfSpaces(tris, ns, hG=0):
+  '''
+  groundのhitbox (makeGrounds()) の半空間
+  Half spaces of ground hitboxs (makeGrounds())
+  * returns: (n (N, 6, 3), c (N, 6))
+  '''
+  tris = np.asarray(tris, 'd')
+  verts = extendTriangles(tris, [0, 2])
+  n, c = prismHalfSpaces(verts-(0,108,0), (0,108+hG,0))
+  # cut by y >= min y-30
+  ySlice = tris[...,1].min(axis=1)-30
+  nCut = np.zeros((len(tris), 1, 3))
+  nCut[...,1] = 1
+  return np.concatenate([n, nCut], axis=1), np.concatenate([c, ySlice[:,None]], axis=1)
+def wallHalfSpaces(tris, ns, rW=50, dy=30):
+  '''
+  wallのhitbox (makeWalls()) の半空間
+  Half spaces of wall hitboxs (makeWalls())
+  * returns: (n (N, 5, 3), c (N, 5))
+  '''
+  verts, _ = makeWalls(tris, ns, rW, dy)
+  return prismHalfSpaces(verts[:,:3], verts[:,3]-verts[:,0])
+
+def surfaces2arrays(tris):
+  '''
+  Surfaceのリスト(またはSurfaceTable)から(verts (N, 3, 3), n (N, 3))を返す
+  Return (verts (N, 3, 3), n (N, 3)) of list of Surface (or SurfaceTable)
+  '''
+  if isinstance(tris, SurfaceTable):
+    return tris.verts.astype('d'), tris.n.astype('d')
+  return (
+    np.array([tri.verts for tri in tris], 'd').reshape(-1, 3, 3),
+    np.array([tri.n for tri in tris], 'd').reshape(-1, 3),
+  )
+
+# list kind (index of CHECK_LIST_KINDS) of each kind of hitboxs
+HITBOX_LIST_KINDS = (1, 0, 2, 2)
+# name of each kind of hitboxs
+HITBOX_NAMES = ('roof', 'ground', 'wall', 'wall2')
+
+def make_hitboxs(gnds, roofs, walls, airborne=True, yoshi=False, cache=None):
+  '''
+  Surfaceのリスト(またはSurfaceTable)から各種類のhitboxを作る
+  Make each kind of hitboxs from lists of Surface (or SurfaceTable)
+  * cache: HitboxCache or None
+  * returns: [((verts, edges, n), awmul, alen, facecolor, arcolor)]
+  '''
+  return make_hitboxs_arrays([surfaces2arrays(tris) for tris in (gnds, roofs, walls)], airborne, yoshi, cache)
+def makeRoofHitboxs(verts, ns, hR):
+  '''
+  * returns: (verts (N, 6, 3), edges (N, 9, 2), n (N, 3))
+  '''
+  return (*makeRoofs(verts, hR), np.tile([0, -1, 0], (len(verts), 1)))
+def makeGroundHitboxs(verts, ns, hG):
+  '''
+  * returns: (verts (N, 8, 3), edges (N, 12, 2), n (N, 3))
+  '''
+  return (*makeGrounds(verts, hG), np.tile([0, 1, 0], (len(verts), 1)))
+def makeWallHitboxs(verts, ns, rW, dy):
+  '''
+  * returns: (verts (N, 6, 3), edges (N, 9, 2), n (N, 3))
+  '''
+  return (*makeWalls(verts, ns, rW, dy), ns)
+
+def hitboxHalfSpaces(builder, verts, ns, *params):
+  '''
+  builder(verts, ns, *params)で作るhitboxの半空間
+  Half spaces of hitboxs made by builder(verts, ns, *params)
+  * returns: (n (N, F, 3), c (N, F))
+  '''
+  return {
+    makeRoofHitboxs: roofHalfSpaces,
+    makeGroundHitboxs: groundHalfSpaces,
+    makeWallHitboxs: wallHalfSpaces,
+  }[builder](verts, ns, *params)
+
+def hitbox_specs(airborne=True, yoshi=False):
+  '''
+  各種類のhitboxの作り方と描き方
+  How to make and draw each kind of hitboxs
+  * returns: [(list kind, builder, params, awmul, alen, facecolor, arcolor)]
+    builder(verts, n, *params) -> (verts, edges, n)
+  '''
+  rW = 80 if yoshi else 50
+  return [
+    (
+      1, makeRoofHitboxs, (82 if airborne else 2,),
+      ##1.0, 78.0 if airborne else 158.0, '#f88e', '#800',
+      ## FIXME: draw arrow
+      1.0, 0, '#f88e', '#800',
+    ),
+    (
+      0, makeGroundHitboxs, (0 if airborne else 0,), # TODO hG=100
+      # TODO grounded hitbox
+      ## FIXME: draw arrow
+      1.0, 0, '#88fe', '#008', # TODO
+    ),
+    *(
+      (
+        2, makeWallHitboxs, (w, dy),
+        # arrow size scale (0.5 if radius is 25)
+        1.0 if airborne or ii == 1 else 0.5, rW, ['#8fcc', '#8f8c'][ii], ['#084', '#080'][ii],
+      )
+      for ii, (w, dy) in zip((1, 0), [(rW, 30), (rW, 150)] if airborne else [(rW, 60), (rW/2, 30)])
+    ),
+  ]
+
+def make_hitboxs_arrays(tris, airborne=True, yoshi=False, cache=None, keys=None):
+  '''
+  三角形の配列から各種類のhitboxを作る
+  Make each kind of hitboxs from arrays of triangles
+  * tris:
+    (ground, roof, wall)の(verts (N, 3, 3), n (N, 3))
+    (verts (N, 3, 3), n (N, 3)) of (ground, roof, wall)
+  * cache:
+    HitboxCache or None
+  * keys:
+    (ground, roof, wall)の三角形のhashTriangles() (Noneならcacheが計算する)
+    hashTriangles() of triangles of (ground, roof, wall) (computed by cache if None)
+  * returns: [((verts, edges, n), awmul, alen, facecolor, arcolor)]
+    See HITBOX_LIST_KINDS for the list kind of each element
+  '''
+  with span('hitbox'):
+    return [
+      (
+        builder(*tris[j], *params) if cache is None else
+        cache.build(builder, params, *tris[j], None if keys is None else keys[j]),
+        *style,
+      )
+      for j, builder, params, *style in hitbox_specs(airborne, yoshi)
+    ]
+
+def hashTriangles(verts, ns):
+  '''
+  三角形の頂点と法線ベクトル(float32)のFNV-1aハッシュ
+  FNV-1a hash of vertices and normal vectors (as float32) of triangles
+  * verts: (N, 3, 3)
+  * ns: (N, 3)
+  * returns: (N,) u8
+  '''
+  words = np.concatenate([
+    np.asarray(verts, 'f4').reshape(-1, 9),
+    np.asarray(ns, 'f4').reshape(-1, 3),
+  ], axis=1).view('u4').astype('u8')
+  h = np.full(len(words), 0xcbf29ce484222325, 'u8')
+  prime = np.uint64(0x100000001b3)
+  with np.errstate(over='ignore'):
+    for k in range(words.shape[1]):
+      h = (h ^ words[:, k]) * prime
+  return h
+
+class HitboxTable:
+  '''
+  1種類(builder, params)のhitboxを固定長の配列に保持するLRUテーブル
+  LRU table keeping hitboxs of one kind (builder, params) in fixed-size arrays
+  '''
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self.index = {} # key -> slot
+    self.slotKeys = []
+    self.lastUsed = np.zeros(0, 'i8')
+    self.arrays = None
+  def lookup(self, keys):
+    return np.array([self.index.get(k, -1) for k in keys.tolist()], 'i8')
+  def alloc(self, n, tick):
+    '''
+    n個のslotを確保する。足りなければNone
+    Allocate n slots. Return None if not enough
+    '''
+    size = len(self.slotKeys)
+    nFree = self.capacity-size
+    nEvict = max(0, n-nFree)
+    if nEvict > 0:
+      # evict least recently used slots not used in this tick
+      evictable = np.nonzero(self.lastUsed < tick)[0]
+      if len(evictable) < nEvict: return None
+      victims = evictable[np.argpartition(self.lastUsed[evictable], nEvict-1)[:nEvict]]
+      for i in victims.tolist(): del self.index[self.slotKeys[i]]
+    else:
+      victims = np.zeros(0, 'i8')
+    nNew = n-nEvict
+    if nNew > 0:
+      self.slotKeys.extend([None]*nNew)
+      self.lastUsed = np.concatenate([self.lastUsed, np.zeros(nNew, 'i8')])
+    return np.concatenate([victims, np.arange(size, size+nNew)])
+  def store(self, slots, keys, hitboxs):
+    if self.arrays is None:
+      self.arrays = [np.empty((0,)+a.shape[1:], a.dtype) for a in hitboxs]
+    size = len(self.slotKeys)
+    if size > len(self.arrays[0]):
+      # grow arrays geometrically
+      cap = min(self.capacity, max(size, 2*len(self.arrays[0]), 64))
+      self.arrays = [
+        np.concatenate([a, np.empty((cap-len(a),)+a.shape[1:], a.dtype)])
+        for a in self.arrays
+      ]
+    for a, new in zip(self.arrays, hitboxs): a[slots] = new
+    for i, k in zip(slots.tolist(), keys.tolist()):
+      self.slotKeys[i] = k
+      self.index[k] = i
+
+class HitboxCache:
+  '''
+  (三角形の内容, hitboxの種類, パラメータ)をキーとするhitboxのLRUキャッシュ
+  LRU cache of hitboxs keyed by (content of triangle, kind of hitbox, params)
+  * maxEntries:
+    hitboxの種類ごとの最大数
+    Max number of entries per kind of hitbox
+  * hits, misses:
+    キャッシュにあった/なかった三角形の数
+    Number of triangles found/not found in the cache
+  '''
+  def __init__(self, maxEntries=16384):
+    self.maxEntries = maxEntries
+    self.tables = {}
+    self.tick = 0
+    self.hits = self.misses = 0
+  def clear(self):
+    self.tables.clear()
+  def resetStats(self):
+    self.hits = self.misses = 0
+  def stats(self):
+    '''
+    * returns: dict(hits, misses, entries, tables)
+    '''
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'entries': sum(len(t.index) for t in self.tables.values()),
+      'tables': len(self.tables),
+    }
+  def build(self, builder, params, verts, ns, keys=None):
+    '''
+    builder(verts, ns, *params)と同じ結果を、キャッシュにないものだけ作って返す
+    Return the same result as builder(verts, ns, *params),
+    building only those not in the cache
+    * keys:
+      三角形のキー(Noneの場合はhashTriangles())
+      Keys of triangles (hashTriangles() if None)
+    '''
+    self.tick += 1
+    if keys is None: keys = hashTriangles(verts, ns)
+    table = self.tables.get((builder, params))
+    if table is None:
+      table = self.tables[builder, params] = HitboxTable(self.maxEntries)
+    slots = table.lookup(keys)
+    miss = slots < 0
+    nMiss = int(miss.sum())
+    self.hits += len(keys)-nMiss
+    self.misses += nMiss
+    if nMiss:
+      uKeys, first, inv = np.unique(keys[miss], return_index=True, return_inverse=True)
+      iMiss = np.nonzero(miss)[0][first]
+      table.lastUsed[slots[~miss]] = self.tick # protect hits from eviction
+      newSlots = table.alloc(len(uKeys), self.tick)
+      if newSlots is None:
+        # too many triangles to keep: build without caching
+        return builder(verts, ns, *params)
+      table.store(newSlots, uKeys, builder(verts[iMiss], ns[iMiss], *params))
+      slots[miss] = newSlots[inv]
+    table.lastUsed[slots] = self.tick
+    if table.arrays is None: return builder(verts, ns, *params)
+    return tuple(a[slots] for a in table.arrays)
+
+# arrow paras
+arrowWidthBase = 70
+arrowWidthMul = 0.5
+arrowLenMax = 200 #80
+arrowLenTher = 200
+arrowLenMul1 = 0.7
+arrowLenMul2 = 0.35
+arrowHeadLenMul = 0.3
+arrowLenMul2off = 0.1 #0.025
+arrowCountMax = 100
+aw, ah = 0.2, 0.6 # width, height of bottom rect
+arrowVerts = array([
+  [0.0,  aw],
+  [ ah,  aw],
+  [ ah, 0.5],
+  [1.0, 0.0],
+  [ ah, -.5],
+  [ ah, -aw],
+  [0.0, -aw],
+])
+
+def layoutArrows(polys, ns, awmul):
+  '''
+  各多角形の矢印の頂点を返す
+  Return vertices of the arrows of each polygon
+  * polys:
+    2次元の多角形の集合 (Polygons)
+    2D polygons (Polygons)
+  * ns:
+    各多角形の押し出す方向 (P, 2)
+    Push direction of each polygon (P, 2)
+  * awmul:
+    矢印の幅の倍率
+    Multiplier of arrow width
+  * returns: (A, 7, 2)
+  '''
+  # polygons with arrow
+  nnorm = np.linalg.norm(ns, axis=1)
+  counts = polys.counts
+  jP = np.nonzero((nnorm != 0) & (counts > 0))[0] # TODO nnorm == 0
+  if len(jP) == 0: return np.zeros((0, len(arrowVerts), 2))
+  n = ns[jP]/nnorm[jP,None]
+  l = np.column_stack([n[:,1], -n[:,0]])
+  counts = counts[jP]
+  vStarts = np.cumsum(counts)-counts
+  ## vertices (V)
+  ownV = np.repeat(np.arange(len(jP)), counts)
+  verts = polys.verts[polys.offsets[jP][ownV]+np.arange(counts.sum())-vStarts[ownV]]
+  ## center
+  C = np.add.reduceat(verts, vStarts)/counts[:,None]
+  vertsO = verts-C[ownV]
+  ## n-l coordinates
+  nn = (vertsO*n[ownV]).sum(axis=1)
+  ll = (vertsO*l[ownV]).sum(axis=1)
+  ## determine arrow width and count
+  minl = np.minimum.reduceat(ll, vStarts)
+  maxl = np.maximum.reduceat(ll, vStarts)
+  dl = maxl-minl
+  arrowWidth = np.full(len(jP), arrowWidthBase*awmul)
+  nArrow = np.floor(dl/arrowWidth).astype('i8')
+  few = nArrow < 1
+  arrowWidth[few] = dl[few]
+  nArrow = np.clip(nArrow, 1, arrowCountMax)
+  arrowWidth *= arrowWidthMul
+
+  ## edges (E): (i0, i1) = (i, i+1) in each polygon
+  iE0 = np.arange(len(verts))
+  iE1 = iE0+1
+  iE1[vStarts+counts-1] = vStarts
+  ownE = ownV
+  ## samples covered by each edge, at ls[k] = minl+dl*(k+1)/(nArrow+1)
+  nA1 = (nArrow+1)[ownE]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    t0 = (ll[iE0]-minl[ownE])/dl[ownE]*nA1-1
+    t1 = (ll[iE1]-minl[ownE])/dl[ownE]*nA1-1
+  eps = 1e-9
+  flat = dl[ownE] == 0
+  kStart = np.where(flat, 0, np.ceil(np.minimum(t0, t1)-eps)).clip(0, None).astype('i8')
+  kEnd = np.where(flat, 0, np.floor(np.maximum(t0, t1)+eps)).clip(None, nA1-2).astype('i8')
+  nK = (kEnd-kStart+1).clip(0, None)
+  ## pairs of (edge, sample)
+  pE = np.repeat(np.arange(len(iE0)), nK)
+  pK = kStart[pE]+np.arange(nK.sum())-np.repeat(np.cumsum(nK)-nK, nK)
+  own = ownE[pE]
+  aStarts = np.cumsum(nArrow)-nArrow
+  pA = aStarts[own]+pK # index of arrow
+  lb = minl[own]+dl[own]*(pK+1)/(nArrow[own]+1)
+  l0, l1 = ll[iE0[pE]], ll[iE1[pE]]
+  n0, n1 = nn[iE0[pE]], nn[iE1[pE]]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    u = np.where(l0 == l1, 0.5, ((lb-l0)/(l1-l0)).clip(0, 1))
+  nb = n0+(n1-n0)*u
+  ## boundaries of each arrow
+  nA = nArrow.sum()
+  nbMax = np.full(nA, -np.inf)
+  nbMin = np.full(nA, np.inf)
+  np.maximum.at(nbMax, pA, nb)
+  np.minimum.at(nbMin, pA, nb)
+  ncts = (nbMax+nbMin)/2
+  nrgs = nbMax-nbMin
+
+  # add arrow
+  ownA = np.repeat(np.arange(len(jP)), nArrow)
+  ls = minl[ownA]+dl[ownA]*(np.arange(nA)-aStarts[ownA]+1)/(nArrow[ownA]+1)
+  nArr, lArr = n[ownA], l[ownA]
+  p = C[ownA]+ncts[:,None]*nArr+ls[:,None]*lArr
+  maty = np.column_stack([-nArr[:,1], nArr[:,0]])*arrowWidth[ownA,None]
+  long = nrgs > arrowLenTher
+  nrg = np.minimum(arrowLenMax, nrgs*np.where(long, arrowLenMul2, arrowLenMul1))
+  dn = nArr*nrg[:,None]
+  verts0 = arrowVerts[None,:,:1]*dn[:,None]+arrowVerts[None,:,1:]*maty[:,None]
+  # long arrow: 2 arrows at both ends; otherwise: 1 arrow at the center
+  m = np.where(long, 2, 1)
+  jA = np.repeat(np.arange(nA), m)
+  second = np.arange(len(jA))-np.repeat(np.cumsum(m)-m, m)
+  offs = np.where(long[jA], np.where(second, 1+arrowLenMul2off, -arrowLenMul2off), 0.5)
+  return (p[jA]-dn[jA]*offs[:,None])[:,None]+verts0[jA]
+
+def hitboxBounds(verts):
+  '''
+  各hitbox(多面体)のAABB
+  AABB of each hitbox (polyhedron)
+  * verts: (N, V, 3)
+  * returns: (mins (N, 3), maxs (N, 3))
+  '''
+  verts = np.asarray(verts, 'd')
+  return verts.min(axis=1), verts.max(axis=1)
+
+def cullBounds(bounds, p0, pn, view=None, margin=arrowLenMax, offsets=(0,)):
+  '''
+  平面 (x-p0)･pn=offsets[k] のどれかと交わり、表示範囲と重なりうるAABBを選ぶ
+  Select AABBs which may intersect any of planes (x-p0)･pn=offsets[k] and overlap the view
+  * bounds: (mins (N, 3), maxs (N, 3))
+  * view: (axes, ((lo0, hi0), (lo1, hi1))) or None
+    表示範囲(投影した座標)
+    Visible range (in projected coordinates)
+  * margin:
+    表示範囲の余白(矢印の長さ)
+    Margin of the view (length of arrows)
+  * returns: bool array (N,)
+  '''
+  mins, maxs = bounds
+  pn = np.asarray(pn, 'd')
+  # distance from the plane to the center, and projected half size
+  dist = ((mins+maxs)/2-p0) @ pn
+  radius = (maxs-mins)/2 @ np.abs(pn)
+  keep = (dist+radius >= min(offsets)) & (dist-radius <= max(offsets))
+  if view is not None:
+    axes, lims = view
+    for i, (lo, hi) in zip(axes, lims):
+      lo, hi = min(lo, hi), max(lo, hi)
+      keep &= (maxs[:,i] >= lo-margin) & (mins[:,i] <= hi+margin)
+  return keep
+
+def slice_hitboxs(hitboxs, p0, pn, keeps=None):
+  '''
+  各種類のhitboxを平面 (x-p0)･pn=0 で切る
+  Slice each kind of hitboxs with plane (x-p0)･pn=0
+  * keeps:
+    各種類の切るhitboxのマスク (cullBounds()の結果、Noneなら全部)
+    Masks of hitboxs to slice of each kind (result of cullBounds(), all if None)
+  * returns: [(polygons (Polygons), n of each polygon)]
+    ids of polygons: indices of hitboxs
+  '''
+  return slice_hitboxs_planes(hitboxs, p0, pn, [0], keeps)[0]
+def slice_hitboxs_planes(hitboxs, p0, pn, offsets, keeps=None):
+  '''
+  各種類のhitboxを平行な複数の平面 (x-p0)･pn=offsets[k] で切る
+  hitboxの選択と頂点の射影は全ての平面で共有する
+  Slice each kind of hitboxs with parallel planes (x-p0)･pn=offsets[k].
+  Selection of hitboxs and projection of vertices are shared by all planes
+  * returns: [[(polygons (Polygons), n of each polygon)] of each kind] of each plane
+  '''
+  ans = [[] for _ in offsets]
+  for c, ((vertss, edgess, ns), *_) in enumerate(hitboxs):
     # draw wall hitboxs (draw in reverse order)
-    for poly, n in polys[::-1]:
-      # clip at y=yy and take (x, z) coordinate
-      verts = poly.slicePlane(p0, pn)[:,axes]
-      if len(verts) == 0: continue
-      # plot hitbox area
-      patches.append((verts, facecolor, 'black')) # (verts, fc, ec)
-      # plot arrow
-      n = n*(1, 0, 1) # no y arrow
-      n = n[axes]
-      nnorm = np.linalg.norm(n)
-      if nnorm == 0: continue # TODO
-      n = n/nnorm
-      l = array([n[1], -n[0]])
-      ## basis matrix
-      B = np.vstack([n, l])
-      ## center
-      C = verts.mean(axis=0)
-      vertsO = verts-C
-      ## n-l coordinates
-      nn = np.dot(vertsO, n)
-      ll = np.dot(vertsO, l)
-      ## determine arrow width and count
-      iminl = ll.argmin()
-      imaxl = ll.argmax()
-      minl = ll[iminl]
-      maxl = ll[imaxl]
-      dl = maxl-minl
-      arrowWidth = arrowWidthBase*awmul
-      nArrow = np.floor(dl/arrowWidth).astype('i')
-      if nArrow >= 1:
-        if nArrow>arrowCountMax: nArrow = arrowCountMax
-      else:
-        arrowWidth = dl
-        nArrow = 1
-      arrowWidth *= arrowWidthMul
-      ## determine arrow position
-      vlen = len(verts)
-      nbss = []
-      ls = np.linspace(minl, maxl, nArrow+2)[1:-1]
-      for step in [1, -1]:
-        i0 = iminl
-        i1 = (i0+step)%vlen
-        nbs = []
-        for lb in ls:
-          while ll[i1] < lb: i0, i1 = i1, (i1+step)%vlen
-          r0 = lb-ll[i0]
-          r1 = ll[i1]-lb
-          nbs.append((nn[i0]+nn[i1])/2 if r0+r1==0 else (nn[i0]*r1+nn[i1]*r0)/(r0+r1))
-        nbss.append(nbs)
-      nbss = array(nbss)
-      ncts = nbss.mean(axis=0)
-      nrgs = np.abs(np.diff(nbss, axis=0)[0])
-      # add arrow
-      maty = array([-n[1], n[0]])*arrowWidth
-      for p, nrg in zip(
-        C+np.matmul(np.column_stack([ncts, ls]), B),
-        nrgs,
-      ):
-        if nrg > arrowLenTher:
-          nrg = min(arrowLenMax, nrg*arrowLenMul2)
-          offs = [-arrowLenMul2off, 1+arrowLenMul2off]
-        else:
-          nrg = min(arrowLenMax, nrg*arrowLenMul1)
-          offs = [0.5]
-        dn = n * nrg
-        # add patches
-        verts0 = np.matmul(arrowVerts, [n*nrg, maty])
-        for off in offs:
-          patches.append((
-            p-dn*off+verts0,
-            arcolor, # fc
-            arcolor, # ec
-          ))
-
-  if len(patches):
-    ax.add_collection(PolyCollection(
-      **{
-        k: v
-        for k, v in zip(('verts', 'facecolors', 'edgecolors'), zip(*patches))
-      },
-    ))
+    idx = np.arange(len(vertss))[::-1]
+    if keeps is not None: idx = idx[keeps[c][idx]]
+    ns = np.asarray(ns, 'd').reshape(-1, 3)
+    with span('slice'):
+      polyss = Polyhedra.fromPacked(vertss[idx], edgess[idx]).slicePlanes(p0, pn, offsets)
+    for slices, polys in zip(ans, polyss):
+      polys.ids = idx[polys.ids]
+      slices.append((polys, ns[polys.ids]))
+  return ans
+
+def make_geo_data(hitboxs, p0, pn, axes, slices=None):
+  '''
+  各hitboxの種類の(多角形, 矢印, 面の色, 矢印の色)を返す
+  Return (polygons, arrows, face color, arrow color) of each kind of hitboxs
+  * slices:
+    slice_hitboxs()の結果 (Noneなら計算する)
+    Result of slice_hitboxs() (computed if None)
+  * polygons: (P, V, 2) padded by repeating the last vertex
+  * arrows: (A, 7, 2)
+  '''
+  if slices is None: slices = slice_hitboxs(hitboxs, p0, pn)
+  ans = []
+  for (polys, ns), (_, awmul, alen, facecolor, arcolor) in zip(slices, hitboxs):
+    # take (x, z) coordinate
+    polys = polys.project(axes)
+    # arrow direction
+    ns = ns*(1, 0, 1) # no y arrow
+    with span('arrow'):
+      arrows = layoutArrows(polys, ns[:,axes], awmul)
+    ans.append((polys.padded(), arrows, facecolor, arcolor))
+  return ans
+
+def make_geo_plot(ax, hitboxs, p0, pn, axes):
+  # plot
+  for polys, arrows, facecolor, arcolor in make_geo_data(hitboxs, p0, pn, axes):
+    if len(polys):
+      ax.add_collection(PolyCollection(polys, facecolors=facecolor, edgecolors='black'))
+    if len(arrows):
+      ax.add_collection(PolyCollection(arrows, facecolors=arcolor, edgecolors=arcolor))
 
   ax.set_xlabel('xyz'[axes[0]])
   ax.set_ylabel('xyz'[axes[1]])
 
   return axes
+
+class GeoPlot:
+  '''
+  hitboxの種類ごとのPolyCollectionを保持し、毎回更新する
+  Keep PolyCollections of each kind of hitboxs and update them every time
+  * alpha, zorder:
+    PolyCollectionの透明度と順番 (重ねて描く層用)
+    Alpha and z-order of PolyCollections (for overlaid layers)
+  '''
+  def __init__(self, ax, alpha=None, zorder=None):
+    self.ax = ax
+    self.alpha = alpha
+    self.zorder = zorder
+    self.layers = [] # [(polygons, arrows)]
+    self.axes = None
+    self.mario = Circle((0, 0), 25, fc='red', visible=False)
+    ax.add_patch(self.mario)
+    ax.grid(True)
+  @property # getter
+  def artists(self):
+    return [c for layer in self.layers for c in layer]+[self.mario]
+  def update(self, data, axes):
+    '''
+    make_geo_data()の結果で更新し、軸が変わったかを返す
+    Update with the result of make_geo_data(),
+    and return whether the axes have changed
+    '''
+    ax = self.ax
+    animated = self.mario.get_animated()
+    while len(self.layers) < len(data):
+      layer = (PolyCollection([], edgecolors='black'), PolyCollection([]))
+      for c in layer:
+        c.set_animated(animated)
+        if self.zorder is not None: c.set_zorder(self.zorder)
+        ax.add_collection(c, autolim=False)
+      self.mario.set_zorder(layer[-1].get_zorder()+1)
+      self.layers.append(layer)
+    for (cPoly, cArrow), (polys, arrows, facecolor, arcolor) in zip(self.layers, data):
+      cPoly.set_verts(polys)
+      cPoly.set_facecolor(facecolor)
+      cArrow.set_verts(arrows)
+      cArrow.set_facecolor(arcolor)
+      cArrow.set_edgecolor(arcolor)
+      if self.alpha is not None:
+        for c in (cPoly, cArrow): c.set_alpha(self.alpha)
+    for layer in self.layers[len(data):]:
+      for c in layer: c.set_verts([])
+    # axes
+    axes = list(axes)
+    if axes == self.axes: return False
+    self.axes = axes
+    ax.set_xlabel('xyz'[axes[0]])
+    ax.set_ylabel('xyz'[axes[1]])
+    return True
+  def setMario(self, pos=None):
+    '''
+    マリオの位置を設定する(Noneなら非表示)
+    Set position of Mario (hidden if None)
+    '''
+    if pos is not None: self.mario.set_center(pos)
+    self.mario.set_visible(pos is not None)
+  def setAnimated(self, animated):
+    for artist in self.artists: artist.set_animated(animated)
+
+def matchKeys(prevKeys, keys):
+  '''
+  keysの各要素がprevKeysにあるかと、その位置を返す
+  2回目以降に出現したキーは見つからなかったとみなす
+  Return whether each element of keys is in prevKeys, and its index.
+  Repeated keys are regarded as not found
+  * returns: (found (bool array), src (index in prevKeys of found keys))
+  '''
+  found = np.zeros(len(keys), bool)
+  if len(prevKeys) == 0 or len(keys) == 0: return found, np.zeros(0, 'i8')
+  sorter = np.argsort(prevKeys)
+  pos = np.searchsorted(prevKeys, keys, sorter=sorter).clip(None, len(prevKeys)-1)
+  found = prevKeys[sorter[pos]] == keys
+  _, first = np.unique(keys, return_index=True)
+  found[np.setdiff1d(np.arange(len(keys)), first)] = False
+  return found, sorter[pos[found]]
+def mergeRows(prev, found, src, new):
+  '''
+  foundの行はprev[src]、それ以外の行はnewの配列を作る
+  Make array whose found rows are prev[src] and other rows are new
+  '''
+  ans = np.empty((len(found),)+new.shape[1:], new.dtype)
+  ans[found] = prev[src]
+  ans[~found] = new
+  return ans
+
+class DynamicHitboxs:
+  '''
+  dynamic collisionのhitboxを三角形の内容のハッシュで管理し、
+  追加・変更された三角形のhitboxだけを作り直す
+  Keep hitboxs of dynamic collision by content hash of triangles,
+  and rebuild (and re-slice) only those of triangles added or changed
+  * keys:
+    (ground, roof, wall)の三角形のハッシュ
+    Hashes of triangles of (ground, roof, wall)
+  * hitboxs:
+    make_hitboxs_arrays()の結果
+    Result of make_hitboxs_arrays()
+  * bounds:
+    各種類のhitboxのAABB (hitboxBounds()の結果)
+    AABBs of each kind of hitboxs (result of hitboxBounds())
+  * kept:
+    最後のslice()でcullされなかったhitboxの数
+    Number of hitboxs not culled in the last slice()
+  * slices:
+    平面(pn, p0･pn) -> (その時のkeys, 切ったhitboxのマスク, slice_hitboxs()の結果)
+    Plane (pn, p0･pn) -> (keys at that time, masks of sliced hitboxs, result of slice_hitboxs())
+  '''
+  def __init__(self):
+    self.params = None
+    self.keys = [np.zeros(0, 'u8') for _ in range(3)]
+    self.hitboxs = None
+    self.bounds = None
+    self.kept = 0
+    self.slices = {}
+    self.slicesPrev = {}
+    self.rebuilt = 0
+  def update(self, tris, keys, airborne=True, yoshi=False, cache=None):
+    '''
+    * tris:
+      (ground, roof, wall)の(verts (N, 3, 3), n (N, 3))
+      (verts (N, 3, 3), n (N, 3)) of (ground, roof, wall)
+    * keys:
+      (ground, roof, wall)の三角形のhashTriangles() (cacheのキーにも使う)
+      hashTriangles() of triangles of (ground, roof, wall) (also used as keys of cache)
+    * cache: HitboxCache or None
+    '''
+    params = (bool(airborne), bool(yoshi))
+    if params != self.params:
+      self.params = params
+      self.keys = [np.zeros(0, 'u8') for _ in range(3)]
+      self.hitboxs = None
+      self.slices.clear()
+    # build hitboxs of new triangles only
+    matches = [matchKeys(prev, cur) for prev, cur in zip(self.keys, keys)]
+    newHitboxs = make_hitboxs_arrays([
+      (verts[~found], n[~found])
+      for (verts, n), (found, _) in zip(tris, matches)
+    ], airborne, yoshi, cache, [
+      np.asarray(k, 'u8')[~found]
+      for k, (found, _) in zip(keys, matches)
+    ])
+    self.rebuilt = sum(int((~found).sum()) for found, _ in matches)
+    if self.hitboxs is None: self.hitboxs = newHitboxs
+    else:
+      self.hitboxs = [
+        (tuple(
+          mergeRows(prev, *matches[j], new)
+          for prev, new in zip(prevHb[0], newHb[0])
+        ), *newHb[1:])
+        for j, prevHb, newHb in zip(HITBOX_LIST_KINDS, self.hitboxs, newHitboxs)
+      ]
+    self.keys = [np.asarray(k, 'u8') for k in keys]
+    self.bounds = [hitboxBounds(vertss) for (vertss, _, _), *_ in self.hitboxs]
+    # keep slices only for the planes of the last frame
+    self.slicesPrev, self.slices = self.slices, {}
+  def slice(self, p0, pn, view=None):
+    '''
+    平面 (x-p0)･pn=0 で切る。前のフレームと同じ平面なら(マリオが平面内で動いても)、
+    変わっていない三角形の結果を再利用する
+    Slice with plane (x-p0)･pn=0.
+    If the plane is the same as the last frame (even if Mario moves within the plane),
+    reuse results of unchanged triangles
+    * view:
+      表示範囲 (See cullBounds())
+      Visible range (See cullBounds())
+    * returns: [(polygons (Polygons), n of each polygon)]
+      ids of polygons: indices of triangles in their list
+    '''
+    pn = np.asarray(pn, 'd')
+    plane = (*pn.tolist(), float(np.asarray(p0, 'd') @ pn))
+    cached = self.slicesPrev.get(plane)
+    ans, keeps = [], []
+    self.kept = 0
+    for c, ((vertss, edgess, ns), *_) in enumerate(self.hitboxs):
+      keep = cullBounds(self.bounds[c], p0, pn, view)
+      self.kept += int(keep.sum())
+      keys = self.keys[HITBOX_LIST_KINDS[c]]
+      reuse = np.zeros(len(keys), bool)
+      polysOld = None
+      if cached is not None:
+        keysOld, keepOld, (polysOld, _) = cached[0][HITBOX_LIST_KINDS[c]], cached[1][c], cached[2][c]
+        found, src = matchKeys(keysOld, keys)
+        # reuse unchanged hitboxs sliced last time and still visible
+        reuse[found] = keepOld[src]
+        reuse &= keep
+        # map old indices to current indices
+        old2cur = np.full(len(keysOld), -1)
+        old2cur[src] = np.nonzero(found)[0]
+        cur = old2cur[polysOld.ids]
+        sel = np.nonzero(cur >= 0)[0]
+        sel = sel[reuse[cur[sel]]]
+        polysOld = polysOld.take(sel)
+        polysOld.ids = cur[sel]
+      keeps.append(keep)
+      iNew = np.nonzero(keep & ~reuse)[0]
+      with span('slice'):
+        polysNew = Polyhedra.fromPacked(vertss[iNew], edgess[iNew]).slicePlane(p0, pn)
+      polysNew.ids = iNew[polysNew.ids]
+      polys = polysNew if polysOld is None else Polygons.concat([polysOld, polysNew])
+      ans.append((polys, np.asarray(ns, 'd').reshape(-1, 3)[polys.ids]))
+    self.slices[plane] = (self.keys, keeps, ans)
+    return ans
@@ -5,8 +5,6 @@ def main():
   import os
   import sys
   import logging
-  from .UI import MainWindow
-  from PyQt5.QtWidgets import QApplication
 
   # set log level
   logging.basicConfig()
@@ -20,9 +18,31 @@ def main():
   logger = logging.getLogger('supSMSTAS')
   logger.setLevel(logging.WARNING if logLevel is None else logLevel)
 
+  # headless subcommands
+  if len(sys.argv) > 1 and sys.argv[1] == 'wfc':
+    from .headless import main as wfc
+    return wfc(sys.argv[2:])
+  if len(sys.argv) > 1 and sys.argv[1] == 'record':
+    from .session import main as record
+    return record(sys.argv[2:])
+  if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+    from .bench import main as bench
+    sys.exit(bench(sys.argv[2:]))
+  if len(sys.argv) > 1 and sys.argv[1] == 'dump':
+    from .headless import dump_main
+    return dump_main(sys.argv[2:])
+
+  # replay a recorded session or a dump of MEM1 instead of Dolphin
+  dolphin = None
+  if len(sys.argv) > 1 and sys.argv[1] == 'replay':
+    from .session import open_replay
+    dolphin, sys.argv[1:] = open_replay(sys.argv[2:])
+
   # execute
+  from .UI import MainWindow
+  from PyQt5.QtWidgets import QApplication
   app = QApplication(sys.argv)
-  w = MainWindow()
+  w = MainWindow(dolphin)
   w.show()
   sys.exit(app.exec_())
 
@@ -0,0 +1,323 @@
+# SPDX-License-Identifier: GPL-3.0-only
+# Copyright (c) 2022 sup39
+
+import sys
+import json
+import time
+import platform
+import numpy as np
+from types import SimpleNamespace
+from .SMS import SMSDolphin, versionID, MEM1_BASE, MEM1_SIZE, CHECK_DATA_SIZE, CHECK_DATA_DTYPE, \
+  CHECK_LIST_ROOT_SIZE, CHECK_LIST_KINDS
+from .shape import Polygon, Polyhedron, Polyhedra
+from . import WFC
+
+# number of triangles of each benchmark
+DEFAULT_SIZES = (100, 1000, 5000)
+# ratio to the baseline regarded as a regression
+DEFAULT_THRESHOLD = 1.25
+
+def random_triangles(n, kind=0, seed=0, extent=4000, height=300):
+  '''
+  ランダムな三角形を作る
+  Make random triangles
+  * kind: index of CHECK_LIST_KINDS
+  * extent, height: range of x, z and y of the centers
+  * returns: (verts (N, 3, 3), n (N, 3))
+  '''
+  rng = np.random.default_rng(seed)
+  c = rng.uniform([-extent, -height, -extent], [extent, height, extent], (n, 1, 3))
+  verts = c+rng.normal(0, 200, (n, 3, 3))
+  if kind == 2:
+    # vertical walls
+    verts[...,1] = c[...,1]+[0, 300, 0]
+  else:
+    verts[...,1] = c[...,1]+rng.normal(0, 30, (n, 3))
+  ns = np.cross(verts[:,1]-verts[:,0], verts[:,2]-verts[:,1])
+  # ground faces up and roof faces down
+  if kind != 2:
+    flip = (ns[:,1] < 0) if kind == 0 else (ns[:,1] > 0)
+    verts[flip] = verts[flip,::-1]
+    ns[flip] *= -1
+  ns /= np.linalg.norm(ns, axis=1)[:,None]
+  return verts, ns
+
+def synthetic_memory(n, blocks=8, kinds=(0, 1, 2), seed=0, extent=4000):
+  '''
+  n個の三角形のstatic collisionを持つMEM1を作る (SMSDolphin.attach()に渡せる)
+  Make MEM1 with n triangles of static collision (can be passed to SMSDolphin.attach())
+  * blocks: number of blocks along x and z
+  * kinds: list kinds (index of CHECK_LIST_KINDS) of triangles, used in turn
+  '''
+  buf = bytearray(MEM1_SIZE)
+  buf[:8] = versionID('GMSJ01')
+  mem32 = np.frombuffer(buf, '>u4')
+  def w32(addr, *vals):
+    mem32[(addr-MEM1_BASE)>>2:((addr-MEM1_BASE)>>2)+len(vals)] = vals
+  # layout
+  ptrMario, ptrMap, ptrCol = 0x80500000, 0x80500100, 0x80500120
+  ptrStCLR = 0x80500200
+  ptrDyCLR = ptrStCLR+CHECK_LIST_ROOT_SIZE*blocks*blocks
+  ptrData = ptrDyCLR+CHECK_LIST_ROOT_SIZE*blocks*blocks
+  ptrNodes = ptrData+CHECK_DATA_SIZE*n
+  symbols = SMSDolphin.symbols[versionID('GMSJ01')]
+  w32(symbols['gpMarioOriginal'], ptrMario)
+  w32(symbols['gpMap'], ptrMap)
+  w32(ptrMap+0x10, ptrCol)
+  limit = blocks*512
+  mem32[(ptrCol-MEM1_BASE)>>2:((ptrCol-MEM1_BASE)>>2)+2] = np.array([limit, limit], '>f4').view('>u4')
+  w32(ptrCol+8, blocks, blocks, 0, ptrStCLR, ptrDyCLR)
+  # TBGCheckData
+  kindOf = np.resize(np.asarray(kinds, 'u1'), n)
+  data = np.zeros(n, CHECK_DATA_DTYPE)
+  for j in range(len(CHECK_LIST_KINDS)):
+    sel = kindOf == j
+    verts, ns = random_triangles(int(sel.sum()), j, seed+j, min(extent, limit-200))
+    data['verts'][sel] = verts
+    data['n'][sel] = ns
+    data['c'][sel] = -np.einsum('ij,ij->i', verts[:,0], ns)
+  buf[ptrData-MEM1_BASE:ptrNodes-MEM1_BASE] = data.tobytes()
+  # register each triangle in the blocks overlapping its AABB
+  lo = ((data['verts'].min(axis=1)+limit)//1024).astype('i8').clip(0, blocks-1)
+  hi = ((data['verts'].max(axis=1)+limit)//1024).astype('i8').clip(0, blocks-1)
+  entries = [
+    ((iz*blocks+ix)*3+kindOf[i], i)
+    for i in range(n)
+    for iz in range(lo[i,2], hi[i,2]+1)
+    for ix in range(lo[i,0], hi[i,0]+1)
+  ]
+  entries.sort()
+  lists = np.array([e[0] for e in entries], 'i8')
+  tris = np.array([e[1] for e in entries], 'i8')
+  # node: (vtable?, next, data)
+  nodes = ptrNodes+12*np.arange(len(entries))
+  last = np.append(lists[1:] != lists[:-1], True)
+  nodes3 = np.zeros((len(entries), 3), 'i8')
+  nodes3[:,1] = np.where(last, 0, nodes+12)
+  nodes3[:,2] = ptrData+CHECK_DATA_SIZE*tris
+  i0 = (ptrNodes-MEM1_BASE)>>2
+  mem32[i0:i0+nodes3.size] = nodes3.ravel()
+  first = np.append(True, lists[1:] != lists[:-1])
+  mem32[((ptrStCLR+4-MEM1_BASE)>>2)+3*lists[first]] = nodes[first]
+  # Mario at the center
+  mem32[((ptrMario+0x10-MEM1_BASE)>>2):((ptrMario+0x10-MEM1_BASE)>>2)+3] = np.zeros(3, '>f4').view('>u4')
+  return SimpleNamespace(buf=memoryview(buf))
+
+def synthetic_dolphin(n, **kwargs):
+  '''
+  synthetic_memory()にattachしたSMSDolphin
+  SMSDolphin attached to synthetic_memory()
+  '''
+  d = SMSDolphin()
+  err = d.attach(synthetic_memory(n, **kwargs))
+  if err is not None: raise RuntimeError(err)
+  return d
+
+# benchmarks: name -> setup(n) -> function to time
+BENCHMARKS = {}
+def benchmark(name):
+  def register(setup):
+    BENCHMARKS[name] = setup
+    return setup
+  return register
+
+@benchmark('extendTriangles')
+def _(n):
+  verts, _ = random_triangles(n)
+  return lambda: WFC.extendTriangles(verts, [0, 2])
+@benchmark('makeGrounds')
+def _(n):
+  verts, _ = random_triangles(n, 0)
+  return lambda: WFC.makeGrounds(verts)
+@benchmark('makeRoofs')
+def _(n):
+  verts, _ = random_triangles(n, 1)
+  return lambda: WFC.makeRoofs(verts)
+@benchmark('makeWalls')
+def _(n):
+  verts, ns = random_triangles(n, 2)
+  return lambda: WFC.makeWalls(verts, ns)
+@benchmark('make_hitboxs_arrays')
+def _(n):
+  tris = [random_triangles(n//3, j, j) for j in range(len(CHECK_LIST_KINDS))]
+  return lambda: WFC.make_hitboxs_arrays(tris)
+
+# ground hitboxs around y=0, most of which intersect the plane y=PLANE_Y
+PLANE_Y = -50
+def random_hitboxs(n):
+  return WFC.makeGrounds(random_triangles(n, height=0)[0])
+@benchmark('Polyhedron.slicePlane')
+def _(n):
+  polys = [Polyhedron(v, e) for v, e in zip(*random_hitboxs(n))]
+  return lambda: [poly.slicePlane((0, PLANE_Y, 0), (0, 1, 0)) for poly in polys]
+@benchmark('Polyhedra.slicePlane')
+def _(n):
+  polys = Polyhedra.fromPacked(*random_hitboxs(n))
+  return lambda: polys.slicePlane((0, PLANE_Y, 0), (0, 1, 0))
+@benchmark('Polyhedra.slicePlanes')
+def _(n):
+  polys = Polyhedra.fromPacked(*random_hitboxs(n))
+  return lambda: polys.slicePlanes((0, PLANE_Y, 0), (0, 1, 0), [-50, -25, 0, 25, 50])
+@benchmark('Polyhedron.clipPlane')
+def _(n):
+  hitboxs = list(zip(*random_hitboxs(n)))
+  def run():
+    for v, e in hitboxs:
+      Polyhedron(v, e).clipPlane((0, PLANE_Y, 0), (0, 1, 0))
+  return run
+@benchmark('Polyhedra.clipPlane')
+def _(n):
+  polys = Polyhedra.fromPacked(*random_hitboxs(n))
+  return lambda: polys.clipPlane((0, PLANE_Y, 0), (0, 1, 0))
+def random_polygons(n):
+  polys = Polyhedra.fromPacked(*random_hitboxs(2*n)).slicePlane((0, PLANE_Y, 0), (0, 1, 0)).project([0, 2])
+  return polys.take(np.arange(len(polys))[:n])
+@benchmark('Polygon.clipLine')
+def _(n):
+  polys = random_polygons(n)
+  vertss = [polys.verts[i0:i1] for i0, i1 in zip(polys.offsets[:-1], polys.offsets[1:])]
+  def run():
+    for verts in vertss:
+      Polygon(verts).clipLine((0, 0), (1, 0), 0)
+  return run
+@benchmark('Polygons.clipLine')
+def _(n):
+  polys = random_polygons(n)
+  return lambda: polys.clipLine((0, 0), (1, 0), 0)
+
+@benchmark('make_geo_plot')
+def _(n):
+  from matplotlib.figure import Figure
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
+  fig = Figure(figsize=(5, 5), dpi=100)
+  FigureCanvasAgg(fig)
+  ax = fig.add_subplot()
+  hitboxs = WFC.make_hitboxs_arrays([random_triangles(n//3, j, j) for j in range(len(CHECK_LIST_KINDS))])
+  p0 = np.zeros(3)
+  def run():
+    ax.cla()
+    WFC.make_geo_plot(ax, hitboxs, p0, (0, 1, 0), [0, 2])
+    ax.set_xlim(-4000, 4000)
+    ax.set_ylim(-4000, 4000)
+    fig.canvas.draw()
+  return run
+
+@benchmark('checkList2list')
+def _(n):
+  # all triangles in the ground list of 1 block
+  d = synthetic_dolphin(n, blocks=1, kinds=(0,), extent=300)
+  ptr = d.read_uint32(('gpMap', 0x10, 0x14))+4
+  head = d.read_uint32(ptr)
+  return lambda: d.checkList2list(head)
+@benchmark('compute_frame')
+def _(n):
+  from .pipeline import compute_frame, WFCParams, WFCCache
+  d = synthetic_dolphin(n)
+  params, cache = WFCParams(True, False, 0), WFCCache()
+  return lambda: compute_frame(d, params, cache)
+
+def measure(fn, minTime=0.2, repeat=5):
+  '''
+  fnの1回あたりの時間(秒)を測る
+  Measure time (seconds) per call of fn
+  * returns: (best, median, number of calls per run)
+  '''
+  fn()
+  # calibrate the number of calls per run
+  loops = 1
+  while True:
+    t0 = time.perf_counter()
+    for _ in range(loops): fn()
+    dt = time.perf_counter()-t0
+    if dt >= minTime/repeat or loops >= 1<<20: break
+    loops *= 2 if dt == 0 else max(2, min(10, int(minTime/repeat/dt)+1))
+  times = []
+  for _ in range(repeat):
+    t0 = time.perf_counter()
+    for _ in range(loops): fn()
+    times.append((time.perf_counter()-t0)/loops)
+  return min(times), float(np.median(times)), loops
+
+def run_benchmarks(sizes=DEFAULT_SIZES, names=None, minTime=0.2, repeat=5, log=None):
+  '''
+  ベンチマークを実行する
+  Run benchmarks
+  * names: substrings of names of benchmarks to run (None: all)
+  * log: function to print progress (None: silent)
+  * returns: [{'name', 'n', 'best', 'median', 'loops'}] (seconds per call)
+  '''
+  ans = []
+  for name, setup in BENCHMARKS.items():
+    if names and not any(s in name for s in names): continue
+    for n in sizes:
+      best, median, loops = measure(setup(n), minTime, repeat)
+      ans.append({'name': name, 'n': n, 'best': best, 'median': median, 'loops': loops})
+      if log is not None: log('%-24s n=%-6d %10.3f ms'%(name, n, median*1000))
+  return ans
+
+def environment():
+  import matplotlib
+  return {
+    'python': platform.python_version(),
+    'numpy': np.__version__,
+    'matplotlib': matplotlib.__version__,
+    'machine': platform.machine(),
+    'system': platform.system(),
+    'processor': platform.processor(),
+  }
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+  '''
+  ベースラインとの比を各結果に加え、回帰した結果を返す
+  ノイズの影響が小さい最短時間で比べる
+  Add ratio to the baseline to each result, and return regressed results.
+  The best times are compared as they are less affected by noise
+  * baseline: results of run_benchmarks()
+  '''
+  base = {(r['name'], r['n']): r for r in baseline}
+  regressions = []
+  for r in results:
+    b = base.get((r['name'], r['n']))
+    if b is None: continue
+    r['baseline'] = b['best']
+    r['ratio'] = r['best']/b['best']
+    if r['ratio'] > threshold: regressions.append(r)
+  return regressions
+
+def main(argv=None):
+  '''
+  `supSMSTAS bench`
+  '''
+  import argparse
+  parser = argparse.ArgumentParser(prog='supSMSTAS bench', description='Benchmark geometry and plotting hot paths')
+  parser.add_argument('-n', '--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+    help='numbers of triangles (default: %s)'%' '.join(map(str, DEFAULT_SIZES)))
+  parser.add_argument('-k', '--select', action='append',
+    help='run only benchmarks whose names contain the string (can be repeated)')
+  parser.add_argument('-o', '--output', help='write results as JSON')
+  parser.add_argument('--baseline', help='compare with results in JSON')
+  parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+    help='ratio to the baseline regarded as a regression (default: %s)'%DEFAULT_THRESHOLD)
+  parser.add_argument('--min-time', type=float, default=0.2, help='seconds to measure each benchmark')
+  parser.add_argument('--list', action='store_true', help='list benchmarks')
+  args = parser.parse_args(argv)
+  if args.list:
+    print('\n'.join(BENCHMARKS))
+    return 0
+  results = run_benchmarks(args.sizes, args.select, args.min_time, log=lambda s: print(s, file=sys.stderr))
+  regressions = []
+  if args.baseline is not None:
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f)['results'], args.threshold)
+    for r in regressions:
+      print('regression: %s n=%d %.3f ms -> %.3f ms (x%.2f)'%(
+        r['name'], r['n'], r['baseline']*1000, r['best']*1000, r['ratio'],
+      ), file=sys.stderr)
+  report = {'environment': environment(), 'results': results}
+  if args.output is None:
+    json.dump(report, sys.stdout, indent=1)
+    print()
+  else:
+    with open(args.output, 'w') as f:
+      json.dump(report, f, indent=1)
+  return 1 if regressions else 0
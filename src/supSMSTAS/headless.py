@@ -0,0 +1,150 @@
+# SPDX-License-Identifier: GPL-3.0-only
+# Copyright (c) 2022 sup39
+
+import os
+import numpy as np
+from numpy import array
+from matplotlib.figure import Figure
+from .WFC import GeoPlot, HITBOX_NAMES
+from .pipeline import WFCParams, compute_frame
+from .timing import PROFILER
+
+def hook_dolphin(dump=None):
+  '''
+  Dolphinにhookし、SMSDolphinを返す
+  Hook Dolphin and return SMSDolphin
+  * dump:
+    Dolphinの代わりに読み込むMEM1のダンプファイル
+    Dump file of MEM1 to read instead of Dolphin
+  '''
+  from .SMS import SMSDolphin, DumpDolphin
+  d = SMSDolphin() if dump is None else DumpDolphin(dump)
+  err = d.hook()
+  if err is not None: raise RuntimeError(err)
+  return d
+
+def frame2arrays(frame):
+  '''
+  WFCFrameを名前 -> 配列の辞書にする
+  Convert WFCFrame to dict of name -> array
+  * pos: (3,)
+  * plane{i}_pn, plane{i}_axes
+  * plane{i}_{kind}_polys: (P, V, 2) padded by repeating the last vertex
+  * plane{i}_{kind}_arrows: (A, 7, 2)
+  * layer{k}_dy, layer{k}_{kind}_polys, layer{k}_{kind}_arrows:
+    extra horizontal slices
+  '''
+  ans = {'pos': array(frame.pos, 'd')}
+  def addData(prefix, data):
+    for name, (polys, arrows, _, _) in zip(HITBOX_NAMES, data):
+      ans['%s_%s_polys'%(prefix, name)] = np.asarray(polys, 'd')
+      ans['%s_%s_arrows'%(prefix, name)] = np.asarray(arrows, 'd').reshape(-1, 7, 2)
+  for i, (pn, axes, data) in enumerate(frame.planes):
+    ans['plane%d_pn'%i] = array(pn, 'd')
+    ans['plane%d_axes'%i] = array(axes, 'i8')
+    addData('plane%d'%i, data)
+  for k, (dy, data) in enumerate(frame.layers):
+    ans['layer%d_dy'%k] = array(dy, 'd')
+    addData('layer%d'%k, data)
+  return ans
+
+def render_frame(frame, radius=1000, width=11, height=5, dpi=100):
+  '''
+  WFCFrameをQtなしでmatplotlibのFigureに描画する
+  Draw WFCFrame on matplotlib Figure without Qt
+  '''
+  fig = Figure(figsize=(width, height), dpi=dpi)
+  pos = frame.pos
+  for i, (pn, axes, data) in enumerate(frame.planes):
+    ax = fig.add_subplot(1, len(frame.planes), i+1)
+    if i == 0:
+      for _, layer in frame.layers:
+        GeoPlot(ax, alpha=0.25, zorder=0.5).update(layer, axes)
+    plot = GeoPlot(ax)
+    plot.update(data, axes)
+    plot.setMario(pos[axes])
+    ax.set_xlim(pos[axes[0]]-radius, pos[axes[0]]+radius)
+    ax.set_ylim(pos[axes[1]]-radius, pos[axes[1]]+radius)
+  fig.tight_layout()
+  return fig
+
+def save_frame(frame, path, **kwargs):
+  '''
+  WFCFrameを拡張子に応じてNPZ/SVG/PNGなどに保存する
+  Save WFCFrame as NPZ/SVG/PNG etc. according to the extension
+  '''
+  if os.path.splitext(path)[1].lower() == '.npz':
+    np.savez_compressed(path, **frame2arrays(frame))
+  else:
+    render_frame(frame, **kwargs).savefig(path)
+
+def main(argv=None):
+  '''
+  `supSMSTAS wfc`
+  '''
+  import argparse
+  parser = argparse.ArgumentParser(prog='supSMSTAS wfc', description='Compute WFC without GUI')
+  parser.add_argument('-o', '--output', action='append', default=[],
+    help='output file (.npz/.svg/.png, can be repeated)')
+  parser.add_argument('--pos', type=float, nargs=3, metavar=('X', 'Y', 'Z'),
+    help='position to inspect (default: Mario)')
+  parser.add_argument('--angle', type=float, default=0,
+    help='angle of the x/z-y plane (0-100, same as the dial)')
+  parser.add_argument('--grounded', action='store_true')
+  parser.add_argument('--yoshi', action='store_true')
+  parser.add_argument('--radius', type=float, default=1000)
+  parser.add_argument('--whole-stage', action='store_true',
+    help='use snapshot of static collision of the whole stage')
+  parser.add_argument('--heights', type=float, nargs='*',
+    help='offsets of y of extra horizontal slices')
+  parser.add_argument('--replay', metavar='SESSION',
+    help='read a recorded session file instead of Dolphin')
+  parser.add_argument('--frame', type=int, default=0,
+    help='frame of the session to replay')
+  parser.add_argument('--profile', metavar='PATH',
+    help='save time of each stage as JSON/CSV')
+  parser.add_argument('--dump', metavar='MEM1',
+    help='read a dump file of MEM1 (See `supSMSTAS dump`) instead of Dolphin')
+  args = parser.parse_args(argv)
+  if args.replay is not None:
+    from .session import SessionReplay
+    d = SessionReplay(args.replay)
+    d.seek(args.frame)
+  else:
+    d = hook_dolphin(args.dump)
+  params = WFCParams(
+    airborne=not args.grounded,
+    yoshi=args.yoshi,
+    xzAngle=args.angle,
+    radius=args.radius,
+    snapshot=args.whole_stage,
+    heights=args.heights,
+  )
+  PROFILER.setEnabled(args.profile is not None)
+  frame = compute_frame(d, params, pos=args.pos)
+  if frame is None: raise RuntimeError('Failed to read memory')
+  if args.profile is not None: PROFILER.export(args.profile)
+  for path in args.output:
+    save_frame(frame, path, radius=args.radius)
+  if not args.output:
+    print('pos: (%.1f, %.1f, %.1f)'%tuple(frame.pos))
+    for name, a in frame2arrays(frame).items():
+      if name.endswith('_polys') or name.endswith('_arrows'):
+        print('%s: %d'%(name, len(a)))
+
+def dump_main(argv=None):
+  '''
+  `supSMSTAS dump`
+  '''
+  import argparse
+  from .SMS import dump_memory
+  parser = argparse.ArgumentParser(prog='supSMSTAS dump', description='Save MEM1 of Dolphin to a file')
+  parser.add_argument('output', help='dump file to write')
+  args = parser.parse_args(argv)
+  d = hook_dolphin()
+  dump_memory(d, args.output)
+  pos = d.read_struct(('gpMarioOriginal', 0x10), '>3f')
+  print('%s: %s, Mario at %s'%(
+    args.output, d.memory.buf[:6].tobytes().decode(errors='replace'),
+    'None' if pos is None else '(%.1f, %.1f, %.1f)'%pos,
+  ))
@@ -0,0 +1,264 @@
+# SPDX-License-Identifier: GPL-3.0-only
+# Copyright (c) 2022 sup39
+
+import time
+import logging
+import threading
+import numpy as np
+from numpy import array
+from collections import namedtuple
+from .WFC import make_hitboxs, slice_hitboxs_planes, make_geo_data, DynamicHitboxs, HitboxCache, hitboxBounds, cullBounds, \
+  hashTriangles
+from .SMS import CHECK_LIST_KINDS, blockOffsetsInRect
+from .shape import Polygons
+from .timing import PROFILER
+
+logger = logging.getLogger('supSMSTAS')
+TRACE = 5 # logging.TRACE (See UI.py)
+
+WFCParams = namedtuple('WFCParams', [
+  'airborne', 'yoshi', 'xzAngle', 'radius', 'snapshot', 'center', 'views', 'heights',
+], defaults=[1000, False, None, None, None])
+'''
+* airborne, yoshi: bool
+* xzAngle: value of the angle dial (0-100)
+* radius: half size of the x-z range to load collision from
+* snapshot: use StageSnapshot for static collision
+* center: (x, z) to inspect instead of Mario (None: Mario)
+* views: visible range ((lo0, hi0), (lo1, hi1)) of each plane
+  (None: center±radius)
+* heights: offsets of y of extra horizontal slices (None: no extra slices)
+'''
+# heights of the multi-height view (Mario's y ±50)
+MULTI_HEIGHTS = (-50, -25, 25, 50)
+WFCFrame = namedtuple('WFCFrame', ['pos', 'planes', 'time', 'culled', 'layers'], defaults=[None, ()])
+'''
+* pos: position of Mario
+* planes: [(pn, axes, make_geo_data())]
+* time: time.time() when the frame was read
+* culled: (kept, culled) number of hitboxs by AABB culling
+* layers: [(dy, make_geo_data())] of extra horizontal slices
+'''
+
+def xz_plane(xzAngle):
+  '''
+  角度ダイヤルの値からx/z-y平面の(法線ベクトル, 軸)を返す
+  Return (normal vector, axes) of x/z-y plane from the value of angle dial
+  '''
+  theta = xzAngle/50*np.pi
+  pnXZ = (-np.sin(theta), 0, -np.cos(theta))
+  axesXZ = [2 if abs(pnXZ[0])>abs(pnXZ[2]) else 0, 1]
+  return pnXZ, axesXZ
+
+def default_planes(params):
+  '''
+  水平面とx/z-y平面の[(法線ベクトル, 軸)]
+  [(normal vector, axes)] of horizontal plane and x/z-y plane
+  '''
+  return [
+    ((0, 1, 0), [0, 2]),
+    xz_plane(params.xzAngle),
+  ]
+
+def compute_frame(d, params, cache=None, pos=None, planes=None):
+  '''
+  Dolphinのメモリを読み込み、WFCの1フレームを計算する
+  Read memory of Dolphin and compute a frame of WFC
+  * d: SMSDolphin
+  * params: WFCParams
+  * cache: WFCCache or None
+    フレーム間で再利用するデータ
+    Data reused between frames
+  * pos:
+    マリオの位置の代わりに使う位置 (Noneならメモリから読む)
+    Position used instead of Mario's (read from memory if None)
+  * planes:
+    [(法線ベクトル, 軸)] (Noneならdefault_planes())
+    [(normal vector, axes)] (default_planes() if None)
+  * returns: WFCFrame or None
+  '''
+  with PROFILER.frame('compute_frame'):
+    d.beginFrame()
+    try: return _compute_frame(d, params, cache, pos, planes)
+    finally: d.endFrame()
+def _compute_frame(d, params, cache, pos, planes):
+  t = time.time()
+  if pos is None:
+    pos = d.read_struct(('gpMarioOriginal', 0x10), '>3f')
+    if pos is None: return None
+  pos = array(pos, 'd')
+  # center of the plot
+  p0 = pos.copy()
+  if params.center is not None: p0[[0, 2]] = params.center
+  x, y, z = p0
+  # get collision data (static collision)
+  colInfo = d.read_struct(('gpMap', 0x10, 0), '>ffII4xII')
+  if colInfo is None: return None
+  ## all blocks of TBGCheckListRoot[zBlockCount][xBlockCount] in the view
+  r = params.radius
+  rect = x-r, z-r, x+r, z+r
+  colOffs = blockOffsetsInRect(colInfo, *rect)
+  if params.snapshot:
+    stLists = d.getStageSnapshot(colInfo).queryRect(*rect)
+  else:
+    stLists = d.getStaticListsAt(colInfo, colOffs)
+  hbCache = None if cache is None else cache.hitboxs
+  hitboxs = make_hitboxs(*stLists, params.airborne, params.yoshi, hbCache)
+  # get collision data (dynamic collision)
+  _, kinds, data = d.getDynamicDataAt(colInfo, colOffs)
+  verts, ns = data['verts'].astype('d'), data['n'].astype('d')
+  # the same keys as HitboxCache computes
+  keys = hashTriangles(verts, ns)
+  dynamic = (DynamicHitboxs() if cache is None else cache.dynamic)
+  dynamic.update([
+    (verts[kinds==j], ns[kinds==j])
+    for j in range(len(CHECK_LIST_KINDS))
+  ], [keys[kinds==j] for j in range(len(CHECK_LIST_KINDS))], params.airborne, params.yoshi, hbCache)
+  # slice
+  if planes is None: planes = default_planes(params)
+  results = []
+  bounds = [hitboxBounds(vertss) for (vertss, _, _), *_ in hitboxs]
+  total = sum(len(b[0]) for b in bounds)+sum(len(b[0]) for b in dynamic.bounds)
+  kept = 0
+  layers = []
+  for iPlane, (pn, axes) in enumerate(planes):
+    # extra horizontal slices share culling and projection with the main one
+    offsets = [0]
+    if iPlane == 0 and params.heights:
+      offsets += sorted(set(params.heights)-{0})
+    # cull hitboxs not intersecting the planes or out of the view
+    view = None if params.views is None else params.views[iPlane]
+    if view is None: view = [(p0[i]-r, p0[i]+r) for i in axes]
+    view = (axes, view)
+    keeps = [cullBounds(b, p0, pn, view, offsets=offsets) for b in bounds]
+    kept += sum(int(keep.sum()) for keep in keeps)
+    if len(offsets) == 1:
+      dySlicess = [dynamic.slice(p0, pn, view)]
+      kept += dynamic.kept
+    else:
+      dyKeeps = [cullBounds(b, p0, pn, view, offsets=offsets) for b in dynamic.bounds]
+      kept += sum(int(keep.sum()) for keep in dyKeeps)
+      dySlicess = slice_hitboxs_planes(dynamic.hitboxs, p0, pn, offsets, dyKeeps)
+    stSlicess = slice_hitboxs_planes(hitboxs, p0, pn, offsets, keeps)
+    for dy, dySlices, stSlices in zip(offsets, dySlicess, stSlicess):
+      slices = [
+        (Polygons.concat([dyPolys, stPolys]), np.concatenate([dyNs, stNs]))
+        for (dyPolys, dyNs), (stPolys, stNs) in zip(dySlices, stSlices)
+      ]
+      data = make_geo_data(hitboxs, p0, pn, axes, slices)
+      if dy == 0: results.append((pn, axes, data))
+      else: layers.append((dy, data))
+  culled = (kept, total*len(results)-kept)
+  logger.log(TRACE, 'cull: kept %d culled %d', *culled)
+  return WFCFrame(pos, results, t, culled, layers)
+
+class WFCCache:
+  '''
+  フレーム間で再利用するデータ
+  Data reused between frames
+  * dynamic: DynamicHitboxs
+  * hitboxs: HitboxCache
+  '''
+  def __init__(self, maxHitboxs=16384):
+    self.dynamic = DynamicHitboxs()
+    self.hitboxs = HitboxCache(maxHitboxs)
+
+class FrameBuffer:
+  '''
+  最新のフレームだけを保持するバッファ
+  Buffer that keeps only the latest frame
+  '''
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.back = None
+  def put(self, frame):
+    with self.lock:
+      self.back = frame
+  def take(self):
+    '''
+    新しいフレームがあれば返す(なければNone)
+    Return the new frame if any (otherwise None)
+    '''
+    with self.lock:
+      frame, self.back = self.back, None
+    return frame
+
+class FrameWatcher:
+  '''
+  ゲームのフレームが進んだかを判定する
+  Detect whether the game has advanced
+  '''
+  def __init__(self):
+    self.last = None
+  def reset(self):
+    self.last = None
+  def changed(self, d, *extra):
+    '''
+    前回からフレームまたはextraが変わったかを返す
+    Return whether the frame or extra has changed since the last call
+    '''
+    key = (d.readFrameSignature(), *extra)
+    if key == self.last: return False
+    self.last = key
+    return True
+
+class WFCWorker(threading.Thread):
+  '''
+  別スレッドでメモリを読み込みフレームを計算する
+  Read memory and compute frames in another thread
+  * d: SMSDolphin
+  * getParams: () -> WFCParams
+  * callback: () -> None
+    新しいフレームがバッファに入った時に呼ばれる(ワーカースレッドから)
+    Called (from the worker thread) when a new frame is put in the buffer
+  * watcher: FrameWatcher or None
+    設定した場合、ゲームが進んだ時だけフレームを計算する
+    If set, compute frames only when the game has advanced
+  '''
+  def __init__(self, d, getParams, callback=None, fps=0):
+    super().__init__(daemon=True)
+    self.d = d
+    self.getParams = getParams
+    self.callback = callback
+    self.buffer = FrameBuffer()
+    self.cache = WFCCache()
+    self.wakeup = threading.Event()
+    self.stopped = False
+    self.watcher = None
+    self.setFPS(fps)
+  def setFPS(self, fps):
+    self.interval = None if fps == 0 else 1/fps
+    self.wakeup.set()
+  def trigger(self):
+    '''
+    すぐにフレームを計算させる
+    Compute a frame immediately
+    '''
+    self.wakeup.set()
+  def stop(self):
+    '''
+    止める(計算中のフレームは捨てられる)。終了を待つにはjoin()を呼ぶ
+    Stop (the frame being computed is dropped). Call join() to wait for the end
+    '''
+    self.stopped = True
+    self.wakeup.set()
+  def run(self):
+    t0 = time.time()
+    while not self.stopped:
+      # wait until next tick (or triggered)
+      timeout = None if self.interval is None else max(0, t0+self.interval-time.time())
+      if self.wakeup.wait(timeout): self.wakeup.clear()
+      if self.stopped: break
+      t0 = time.time()
+      if not self.d.hooked: continue
+      try:
+        params = self.getParams()
+        watcher = self.watcher
+        if watcher is not None and not watcher.changed(self.d, params): continue
+        frame = compute_frame(self.d, params, self.cache)
+      except:
+        logger.exception('Failed to compute WFC frame')
+        continue
+      if frame is None or self.stopped: continue
+      self.buffer.put(frame)
+      if self.callback is not None: self.callback()
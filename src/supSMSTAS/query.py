@@ -0,0 +1,88 @@
+# SPDX-License-Identifier: GPL-3.0-only
+# Copyright (c) 2022 sup39
+
+import numpy as np
+from collections import namedtuple
+from .WFC import hitbox_specs, hitboxHalfSpaces, surfaces2arrays, HITBOX_NAMES
+from .shape import AABBGrid
+
+PointHits = namedtuple('PointHits', ['classes', 'iPoint', 'iClass', 'iTri', 'normals'])
+'''
+* classes: (M,) u1
+  bit c is set if the point is in any hitbox of kind c (See HITBOX_NAMES)
+* iPoint, iClass, iTri: (K,)
+  every (point, kind of hitbox, triangle) where the hitbox contains the point.
+  iTri is the index in the list of HITBOX_LIST_KINDS[iClass]
+* normals: (K, 3)
+  push normal of each pair
+'''
+
+class HitboxIndex:
+  '''
+  点がどのhitboxに含まれるかを調べるための、hitboxの半空間と空間インデックス
+  Half spaces and spatial index of hitboxs to find the hitboxs containing points
+  * tris:
+    (ground, roof, wall)の(verts (N, 3, 3), n (N, 3))
+    (verts (N, 3, 3), n (N, 3)) of (ground, roof, wall)
+  * cellSize:
+    空間インデックスの格子の大きさ
+    Cell size of the spatial index
+  '''
+  def __init__(self, tris, airborne=True, yoshi=False, cellSize=128):
+    self.tris = tris
+    self.kinds = []
+    for j, builder, params, *_ in hitbox_specs(airborne, yoshi):
+      verts, ns = (np.asarray(a, 'd') for a in tris[j])
+      hVerts, _, hNs = builder(verts, ns, *params)
+      n, c = hitboxHalfSpaces(builder, verts, ns, *params)
+      # normalize half spaces
+      l = np.linalg.norm(n, axis=-1)
+      l[l == 0] = 1
+      self.kinds.append((
+        n/l[...,None], c/l,
+        np.asarray(hNs, 'd').reshape(-1, 3),
+        AABBGrid(hVerts.min(axis=1), hVerts.max(axis=1), cellSize),
+      ))
+  @classmethod
+  def fromDolphin(cls, d, xMin, zMin, xMax, zMax, airborne=True, yoshi=False, **kwargs):
+    '''
+    矩形 [xMin, xMax]×[zMin, zMax] と重なるブロックのcollisionから作る
+    Make from collision of blocks overlapping the rectangle [xMin, xMax]×[zMin, zMax]
+    * self.tables:
+      (ground, roof, wall)のSurfaceTable (iTriの番号に対応する)
+      SurfaceTable of (ground, roof, wall) (indexed by iTri)
+    '''
+    colInfo = d.read_struct(('gpMap', 0x10, 0), '>ffII4xII')
+    tables = d.getCheckListsInRect(colInfo, xMin, zMin, xMax, zMax)
+    self = cls([surfaces2arrays(t) for t in tables], airborne, yoshi, **kwargs)
+    self.tables = tables
+    return self
+  def classify(self, points, chunkSize=1<<16):
+    '''
+    各点を含むhitboxを調べる
+    Find hitboxs containing each point
+    * points: (M, 3)
+    * returns: PointHits
+    '''
+    points = np.asarray(points, 'd').reshape(-1, 3)
+    classes = np.zeros(len(points), 'u1')
+    hits = []
+    for i0 in range(0, len(points), chunkSize):
+      ps = points[i0:i0+chunkSize]
+      for iClass, (n, c, ns, grid) in enumerate(self.kinds):
+        # candidates by AABB, then test all half spaces
+        iP, iT = grid.queryPoints(ps)
+        inside = np.all(np.einsum('kfi,ki->kf', n[iT], ps[iP]) >= c[iT], axis=1)
+        iP, iT = iP[inside], iT[inside]
+        classes[i0+iP] |= 1<<iClass
+        hits.append((i0+iP, np.full(len(iP), iClass, 'u1'), iT, ns[iT]))
+    if len(hits) == 0:
+      return PointHits(classes, np.zeros(0, 'i8'), np.zeros(0, 'u1'), np.zeros(0, 'i8'), np.zeros((0, 3)))
+    iPoint, iClass, iTri, normals = (np.concatenate(a) for a in zip(*hits))
+    order = np.lexsort((iTri, iClass, iPoint))
+    return PointHits(classes, iPoint[order], iClass[order], iTri[order], normals[order])
+  def __repr__(self):
+    return 'HitboxIndex of %s'%', '.join(
+      '%d %s'%(len(grid), name)
+      for name, (_, _, _, grid) in zip(HITBOX_NAMES, self.kinds)
+    )
@@ -0,0 +1,412 @@
+# SPDX-License-Identifier: GPL-3.0-only
+# Copyright (c) 2022 sup39
+
+import mmap
+import time
+import struct
+import numpy as np
+from numpy import array
+from .SMS import MEM1_BASE, CHECK_DATA_SIZE, CHECK_DATA_DTYPE, CHECK_LIST_ROOT_SIZE, CHECK_LIST_KINDS, \
+  StageSnapshot, checkData2table, uniqueAddrs
+
+'''
+セッションファイル
+Session file
+
+  MAGIC, then chunks of (tag '4s', size '<I', payload)
+  * b'STAT': static collision of the whole stage (written when the stage changes)
+    STAT_HEADER_DTYPE, addrs '<u4'[N], kinds 'u1'[N] (padded to 4 bytes),
+    TBGCheckData[N] (raw), starts '<u4'[B*3+1], items '<u4'[I]
+  * b'POOL': TBGCheckData of dynamic collision first seen in the next frame
+    count '<I', addrs '<u4'[N], TBGCheckData[N] (raw)
+  * b'FRAM': a frame
+    FRAME_HEADER_DTYPE, and if dyRef is the frame itself: starts '<u4'[B*3+1], items '<u4'[I]
+  B: number of blocks (xBlockCount*zBlockCount)
+  starts, items:
+    items[starts[b*3+j]:starts[b*3+j+1]] are the triangles in list j of block b
+    (index of STAT for static collision, index of all POOL records for dynamic collision)
+'''
+MAGIC = b'SMSWFC\x00\x01'
+CHUNK_HEADER = struct.Struct('<4sI')
+COL_INFO_DTYPE = np.dtype([
+  ('xLimit', '<f4'), ('zLimit', '<f4'),
+  ('xBlockCount', '<u4'), ('zBlockCount', '<u4'),
+  ('ptrStCLR', '<u4'), ('ptrDyCLR', '<u4'),
+])
+STAT_HEADER_DTYPE = np.dtype([
+  ('colInfo', COL_INFO_DTYPE), ('count', '<u4'), ('nItems', '<u4'),
+])
+FRAME_HEADER_DTYPE = np.dtype([
+  ('time', '<f8'), ('pos', '<f4', (3,)), ('gpMap', '<u4'), ('colInfo', COL_INFO_DTYPE),
+  ('stat', '<u4'), ('dyRef', '<u4'), ('nItems', '<u4'),
+])
+
+def readBlockLists(d, ptrCLR, xBlockCount, zBlockCount):
+  '''
+  全てのブロックの(ground, roof, wall)の三角形のアドレスを読み込む
+  Read addresses of triangles of (ground, roof, wall) in all blocks
+  * returns: (addrs, counts)
+    counts: number of triangles in each list (B*3,)
+  '''
+  addrs, counts = [], []
+  head0 = (ptrCLR+4-MEM1_BASE)>>2
+  for b in range(xBlockCount*zBlockCount):
+    head = head0+b*(CHECK_LIST_ROOT_SIZE>>2)
+    for j in range(len(CHECK_LIST_KINDS)):
+      tris = d.walkCheckList(int(d.mem32[head+3*j]))
+      addrs += tris
+      counts.append(len(tris))
+  return array(addrs, 'u4'), array(counts, 'u4')
+
+def isSessionFile(path):
+  with open(path, 'rb') as f:
+    return f.read(len(MAGIC)) == MAGIC
+
+def padTo4(buf):
+  return buf+bytes(-len(buf)%4)
+
+class SessionRecorder:
+  '''
+  フレームごとにマリオの位置とcollisionをファイルに追記する
+  staticは1回だけ保存し、dynamicは前のフレームとの差分だけ保存する
+  Append position of Mario and collision of each frame to a file.
+  Static collision is stored once,
+  and only the difference from previous frames is stored for dynamic collision
+  * path: path of the session file (overwritten)
+  '''
+  def __init__(self, path):
+    self.f = open(path, 'wb')
+    self.f.write(MAGIC)
+    self.frameCount = 0
+    self.stageKey = None
+    self.statCount = 0
+    # dynamic collision: (addr, raw TBGCheckData) -> index of POOL records
+    self.pool = {}
+    self.lastDynamic = None
+    self.dyRef = 0
+  def __enter__(self):
+    return self
+  def __exit__(self, *args):
+    self.close()
+  def close(self):
+    self.f.close()
+  def writeChunk(self, tag, *parts):
+    parts = [bytes(part) for part in parts]
+    self.f.write(CHUNK_HEADER.pack(tag, sum(map(len, parts))))
+    for part in parts: self.f.write(part)
+  def record(self, d):
+    '''
+    現在のフレームを追記する
+    Append current frame
+    * d: SMSDolphin
+    * returns: index of the frame, or None if failed to read memory
+    '''
+    d.beginFrame()
+    try: return self._record(d)
+    finally: d.endFrame()
+  def _record(self, d):
+    pos = d.read_struct(('gpMarioOriginal', 0x10), '>3f')
+    colInfo = d.read_struct(('gpMap', 0x10, 0), '>ffII4xII')
+    if pos is None or colInfo is None: return None
+    xBlockCount, zBlockCount, ptrStCLR, ptrDyCLR = colInfo[2:]
+    # static collision (when the stage changes)
+    key = d.readStageKey(colInfo)
+    if key != self.stageKey:
+      self.writeStatic(d, colInfo)
+      self.stageKey = key
+    # dynamic collision
+    addrs, counts = readBlockLists(d, ptrDyCLR, xBlockCount, zBlockCount)
+    uAddrs = uniqueAddrs([addrs])
+    raw = d.readCheckData(uAddrs).view('u1').reshape(-1, CHECK_DATA_SIZE)
+    pool = self.pool
+    newAddrs, newRaw, slots = [], [], {}
+    for addr, rec in zip(uAddrs.tolist(), raw):
+      k = (addr, rec.tobytes())
+      i = pool.get(k)
+      if i is None:
+        i = pool[k] = len(pool)
+        newAddrs.append(addr)
+        newRaw.append(k[1])
+      slots[addr] = i
+    items = array([slots[addr] for addr in addrs.tolist()], '<u4')
+    starts = np.concatenate([[0], np.cumsum(counts)]).astype('<u4')
+    if len(newAddrs):
+      self.writeChunk(b'POOL', struct.pack('<I', len(newAddrs)), array(newAddrs, '<u4'), b''.join(newRaw))
+    # reuse the lists of the last frame if unchanged
+    dynamic = (starts, items)
+    last = self.lastDynamic
+    changed = last is None or not (np.array_equal(last[0], starts) and np.array_equal(last[1], items))
+    if changed:
+      self.dyRef = self.frameCount
+      self.lastDynamic = dynamic
+    header = np.zeros((), FRAME_HEADER_DTYPE)
+    header['time'] = time.time()
+    header['pos'] = pos
+    header['gpMap'] = d.read_uint32(('gpMap',))
+    header['colInfo'] = tuple(colInfo)
+    header['stat'] = self.statCount-1
+    header['dyRef'] = self.dyRef
+    header['nItems'] = len(items)
+    self.writeChunk(b'FRAM', header.tobytes(), *((starts, items) if changed else ()))
+    self.f.flush()
+    self.frameCount += 1
+    return self.frameCount-1
+  def writeStatic(self, d, colInfo):
+    xBlockCount, zBlockCount, ptrStCLR = colInfo[2:5]
+    addrs, counts = readBlockLists(d, ptrStCLR, xBlockCount, zBlockCount)
+    kinds = np.repeat(np.tile(np.arange(len(CHECK_LIST_KINDS), dtype='u1'), xBlockCount*zBlockCount), counts)
+    # deduplicate by address
+    uAddrs, idx, items = np.unique(addrs, return_index=True, return_inverse=True)
+    header = np.zeros((), STAT_HEADER_DTYPE)
+    header['colInfo'] = tuple(colInfo)
+    header['count'] = len(uAddrs)
+    header['nItems'] = len(items)
+    self.writeChunk(
+      b'STAT', header.tobytes(),
+      uAddrs.astype('<u4'), padTo4(kinds[idx].tobytes()),
+      d.readCheckData(uAddrs).tobytes(),
+      np.concatenate([[0], np.cumsum(counts)]).astype('<u4'), items.astype('<u4'),
+    )
+    self.statCount += 1
+
+class SessionReplay:
+  '''
+  セッションファイルを再生する
+  compute_frame()などでSMSDolphinの代わりに使える(読み込み専用)
+  Replay a session file.
+  Can be used instead of SMSDolphin by compute_frame() etc. (read only)
+  * path: path of the session file
+  再生するフレームはseek()で選ぶか、play()で記録時の時間に合わせて進める
+  マリオの位置またはフレームのシグネチャを読んだ時にフレームが決まる
+  The frame to replay is chosen by seek(), or follows the recorded time after play().
+  The frame is fixed when the position of Mario or the frame signature is read
+  '''
+  # no write_*() (See SMSDolphin.readOnly)
+  readOnly = True
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if self.mm[:len(MAGIC)] != MAGIC:
+      raise ValueError('Not a session file: %s'%path)
+    self.hooked = True
+    self.stats, frames, pools = [], [], []
+    # scan chunk headers (an incomplete last chunk is ignored)
+    off, size = len(MAGIC), len(self.mm)
+    while off+CHUNK_HEADER.size <= size:
+      tag, n = CHUNK_HEADER.unpack_from(self.mm, off)
+      off += CHUNK_HEADER.size
+      if off+n > size: break
+      if tag == b'FRAM': frames.append(off)
+      elif tag == b'POOL': pools.append(off)
+      elif tag == b'STAT': self.stats.append(off)
+      off += n
+    self.mem8 = np.frombuffer(self.mm, 'u1')
+    self.frameOffsets = array(frames, 'i8')
+    self.headers = self.mem8[
+      self.frameOffsets[:,None]+np.arange(FRAME_HEADER_DTYPE.itemsize)
+    ].view(FRAME_HEADER_DTYPE).reshape(-1)
+    # file offset of each TBGCheckData of dynamic collision
+    counts = array([struct.unpack_from('<I', self.mm, off)[0] for off in pools], 'i8')
+    self.poolAddrs = np.concatenate([np.zeros(0, '<u4')]+[
+      np.frombuffer(self.mm, '<u4', n, off+4) for off, n in zip(pools, counts)
+    ])
+    self.poolOffsets = np.concatenate([np.zeros(0, 'i8')]+[
+      off+4+4*n+CHECK_DATA_SIZE*np.arange(n) for off, n in zip(pools, counts)
+    ])
+    self.statCache = {}
+    self.index = 0
+    self.playing = None
+  def __len__(self):
+    return len(self.frameOffsets)
+  def close(self):
+    self.statCache.clear()
+    self.mem8 = None
+    self.mm.close()
+  def hook(self, *args, **kwargs):
+    return None if len(self) else 'Empty session'
+
+  # frame selection
+  def seek(self, index):
+    '''
+    フレームに移動する (O(1))
+    Go to the frame (O(1))
+    '''
+    self.playing = None
+    self.index = int(np.clip(index, 0, len(self)-1))
+  def play(self, speed=1, start=None):
+    '''
+    記録時の時間のspeed倍でフレームを進める
+    Advance frames at speed times the recorded speed
+    '''
+    if start is not None: self.seek(start)
+    self.playing = (time.time(), self.headers['time'][self.index], speed)
+  def pause(self):
+    self.playing = None
+  def currentFrame(self):
+    if self.playing is not None:
+      t0, tRec0, speed = self.playing
+      tRec = tRec0+(time.time()-t0)*speed
+      self.index = max(0, int(np.searchsorted(self.headers['time'], tRec, 'right'))-1)
+    return self.index
+  def readFrameSignature(self):
+    return self.currentFrame()
+  def beginFrame(self):
+    self.currentFrame()
+  def endFrame(self):
+    pass
+
+  # memory
+  def read_struct(self, addr, fmt):
+    '''
+    compute_frame()が読み込む値だけを返す(他はNone)
+    Return only the values read by compute_frame() (None for others)
+    '''
+    if addr == ('gpMarioOriginal', 0x10) and fmt == '>3f':
+      return tuple(self.headers['pos'][self.currentFrame()].tolist())
+    if addr == ('gpMap', 0x10, 0) and fmt == '>ffII4xII':
+      return self.headers['colInfo'][self.index].item()
+    return None
+  def read_uint32(self, addr):
+    return int(self.headers['gpMap'][self.index]) if addr == ('gpMap',) else None
+  def readStageKey(self, colInfo):
+    return int(self.headers['stat'][self.index])
+
+  # collision
+  def getStatic(self, stat):
+    '''
+    STATの(addrs, kinds, data, starts, items)を返す
+    Return (addrs, kinds, data, starts, items) of STAT
+    '''
+    ans = self.statCache.get(stat)
+    if ans is None:
+      off = self.stats[stat]
+      header = np.frombuffer(self.mm, STAT_HEADER_DTYPE, 1, off)[0]
+      B = int(header['colInfo']['xBlockCount'])*int(header['colInfo']['zBlockCount'])
+      N, I = int(header['count']), int(header['nItems'])
+      off += STAT_HEADER_DTYPE.itemsize
+      addrs = np.frombuffer(self.mm, '<u4', N, off); off += 4*N
+      kinds = np.frombuffer(self.mm, 'u1', N, off); off += N+(-N%4)
+      data = np.frombuffer(self.mm, CHECK_DATA_DTYPE, N, off); off += CHECK_DATA_SIZE*N
+      starts = np.frombuffer(self.mm, '<u4', B*3+1, off); off += 4*(B*3+1)
+      items = np.frombuffer(self.mm, '<u4', I, off)
+      ans = self.statCache[stat] = (addrs, kinds, data, starts, items)
+    return ans
+  def getDynamic(self, index):
+    '''
+    フレームのdynamic collisionの(starts, items)を返す
+    Return (starts, items) of dynamic collision of the frame
+    '''
+    ref = int(self.headers['dyRef'][index])
+    header = self.headers[ref]
+    colInfo = header['colInfo']
+    B = int(colInfo['xBlockCount'])*int(colInfo['zBlockCount'])
+    off = self.frameOffsets[ref]+FRAME_HEADER_DTYPE.itemsize
+    starts = np.frombuffer(self.mm, '<u4', B*3+1, off)
+    items = np.frombuffer(self.mm, '<u4', int(header['nItems']), off+4*(B*3+1))
+    return starts, items
+  def readPool(self, ids):
+    offs = self.poolOffsets[ids]
+    return self.mem8[offs[:,None]+np.arange(CHECK_DATA_SIZE)].view(CHECK_DATA_DTYPE).reshape(-1)
+  def getStaticListsAt(self, colInfo, colOffs):
+    _, _, data, starts, items = self.getStatic(int(self.headers['stat'][self.index]))
+    blocks = np.asarray(colOffs, 'i8')//CHECK_LIST_ROOT_SIZE
+    ans = []
+    for j in range(len(CHECK_LIST_KINDS)):
+      ids = np.concatenate([np.zeros(0, '<u4')]+[items[starts[3*b+j]:starts[3*b+j+1]] for b in blocks])
+      _, idx = np.unique(ids, return_index=True)
+      ans.append(checkData2table(data[ids[np.sort(idx)]]))
+    return ans
+  def getDynamicDataAt(self, colInfo, colOffs):
+    starts, items = self.getDynamic(self.index)
+    blocks = np.asarray(colOffs, 'i8')//CHECK_LIST_ROOT_SIZE
+    idss, kindss = [np.zeros(0, '<u4')], [np.zeros(0, 'u1')]
+    for b in blocks:
+      counts = np.diff(starts[3*b:3*b+4])
+      idss.append(items[starts[3*b]:starts[3*b+3]])
+      kindss.append(np.repeat(np.arange(len(CHECK_LIST_KINDS), dtype='u1'), counts))
+    ids, kinds = np.concatenate(idss), np.concatenate(kindss)
+    addrs = self.poolAddrs[ids]
+    _, idx = np.unique(addrs, return_index=True)
+    idx.sort()
+    return addrs[idx].astype('u4'), kinds[idx], self.readPool(ids[idx])
+  def getDynamicListsAt(self, colInfo, colOffs):
+    _, kinds, data = self.getDynamicDataAt(colInfo, colOffs)
+    return [checkData2table(data[kinds==j]) for j in range(len(CHECK_LIST_KINDS))]
+  def getCheckListsAt(self, colInfo, colOffs):
+    return [
+      st+dy for st, dy in zip(
+        self.getStaticListsAt(colInfo, colOffs),
+        self.getDynamicListsAt(colInfo, colOffs),
+      )
+    ]
+  def getStageSnapshot(self, colInfo):
+    stat = int(self.headers['stat'][self.index])
+    key = ('snapshot', stat)
+    snapshot = self.statCache.get(key)
+    if snapshot is None:
+      addrs, kinds, data, _, _ = self.getStatic(stat)
+      snapshot = self.statCache[key] = StageSnapshot(addrs, kinds, data)
+    return snapshot
+  def __repr__(self):
+    return 'SessionReplay with %d frames'%len(self)
+
+def record_session(d, path, count=None, duration=None, interval=0.001):
+  '''
+  ゲームのフレームが進むたびにフレームを記録する
+  Record a frame every time the game advances
+  * count: number of frames to record (None: until KeyboardInterrupt)
+  * duration: seconds to record (None: until KeyboardInterrupt)
+  * interval: seconds between polls of the frame signature
+  * returns: number of recorded frames
+  '''
+  from .pipeline import FrameWatcher
+  watcher = FrameWatcher()
+  t0 = time.time()
+  with SessionRecorder(path) as recorder:
+    try:
+      while count is None or recorder.frameCount < count:
+        if duration is not None and time.time()-t0 >= duration: break
+        if watcher.changed(d): recorder.record(d)
+        else: time.sleep(interval)
+    except KeyboardInterrupt:
+      pass
+    return recorder.frameCount
+
+def open_replay(argv):
+  '''
+  `supSMSTAS replay`の引数を解析し、セッションファイルまたはMEM1のダンプを開く
+  Parse arguments of `supSMSTAS replay`, and open a session file or a dump of MEM1
+  * returns: (SessionReplay or DumpDolphin, remaining arguments (passed to Qt))
+  '''
+  import os
+  import argparse
+  from .SMS import DumpDolphin
+  parser = argparse.ArgumentParser(prog='supSMSTAS replay', description='Show WFC of a recorded session or a dump of MEM1 without Dolphin')
+  parser.add_argument('path', help='session file or dump of MEM1')
+  parser.add_argument('speed', nargs='?', type=float, help='playback speed of a session file (default: 1)')
+  args, rest = parser.parse_known_args(argv)
+  if not os.path.isfile(args.path):
+    parser.error('No such file: %s'%args.path)
+  if isSessionFile(args.path):
+    d = SessionReplay(args.path)
+    d.play(1 if args.speed is None else args.speed)
+  else:
+    if args.speed is not None: parser.error('speed is only for session files')
+    d = DumpDolphin(args.path)
+  return d, rest
+
+def main(argv=None):
+  '''
+  `supSMSTAS record`
+  '''
+  import argparse
+  from .headless import hook_dolphin
+  parser = argparse.ArgumentParser(prog='supSMSTAS record', description='Record a session for offline replay')
+  parser.add_argument('output', help='session file to write')
+  parser.add_argument('--count', type=int, help='number of frames to record')
+  parser.add_argument('--duration', type=float, help='seconds to record')
+  args = parser.parse_args(argv)
+  d = hook_dolphin()
+  print('Recording... (Ctrl-C to stop)')
+  n = record_session(d, args.output, args.count, args.duration)
+  print('Recorded %d frames'%n)
@@ -33,19 +33,8 @@ class Polygon():
       定数
       Constant
     '''
-    p, n, c = map(array, (p, n, c))
-    r = np.dot(self.verts-p, n)-c
-    verts = []
-    for i in range(len(r)):
-      v0, r0 = self.verts[i-1], r[i-1]
-      v1, r1 = self.verts[i], r[i]
-      if r1 >= 0:
-        if r0 < 0: # (- +)
-          verts.append((r1*v0-r0*v1)/(-r0+r1))
-        verts.append(v1)
-      elif r0 >= 0: # (+ -)
-        verts.append((-r1*v0+r0*v1)/(r0-r1))
-    self.verts = np.array(verts) if len(verts) else self.verts[:0]
+    ans = Polygons(self.verts, [0, len(self.verts)]).clipLine(p, n, c, keepEmpty=True)
+    self.verts = ans.verts
   @property # getter
   def path(self):
     if self.verts.shape[0] == 0: return None
@@ -115,50 +104,19 @@ class Polyhedron:
       定数
       Constant
     '''
-    p = array(p)
-    n = array(n)
-    r = np.dot(self.verts-p, n)-c
-    rb = [s>=0 for s in r]
-    # map vertex indices old to new
-    io2n = {
-      iO: iN
-      for iN, iO in enumerate(iO for iO, sb in enumerate(rb) if sb)
-    }
-    # handle old vert
-    verts = [v for v, sb in zip(self.verts, rb) if sb]
-    edges = []
-    for i0, i1 in self.edges:
-      if rb[i0] and rb[i1]:
-        # remain
-        edges.append((io2n[i0], io2n[i1]))
-      elif rb[i0] or rb[i1]:
-        # new vert
-        v0, r0 = self.verts[i0], abs(r[i0])
-        v1, r1 = self.verts[i1], abs(r[i1])
-        vN = (r1*v0+r0*v1)/(r0+r1)
-        edges.append((io2n[i0 if rb[i0] else i1], len(verts)))
-        verts.append(vN)
-      # else drop edge
-    # add new face
-    nOld = len(io2n)
-    vNews = verts[nOld:]
-    if len(vNews):
-      assert len(vNews) >= 3
-      p0, p1 = vNews[:2]
-      # choose p1-p0 as e1
-      e1 = normalize(p1-p0)
-      # choose e2 that ⊥ n, e1
-      e2 = normalize(np.cross(n, e1))
-      # set (p0+p1)/2 as new origin, and use {e1, e2} as new basis
-      cNews = np.dot(vNews-(p0+p1)/2, array([e1, e2]).transpose())
-      # indices of new verts CCW
-      jNews = nOld+np.arctan2(cNews[:,0], cNews[:,1]).argsort()
-      # add to edge
-      for i in range(len(vNews)):
-        edges.append((jNews[i-1], jNews[i]))
-    # final
-    self.verts = array(verts)
-    self.edges = array(edges)
+    ans = Polyhedra.fromList([self]).clipPlane(p, n, c)
+    self.verts = ans.verts
+    self.edges = ans.edges
+  def clipHalfSpaces(self, ps, ns, cs=0):
+    '''
+    複数の半空間 (x-ps[k])・ns[k] >= cs[k] との共通部分を取る
+    Take intersection with half spaces (x-ps[k])・ns[k] >= cs[k]
+    * ps, ns: (K, 3)
+    * cs: (K,) or scalar
+    '''
+    ans = Polyhedra.fromList([self]).clipHalfSpaces(ps, ns, cs)
+    self.verts = ans.verts
+    self.edges = ans.edges
   def slicePlane(self, p, n):
     '''
     平面 (x-p)･n=0 との共通部分(多角形)の頂点を返す
@@ -202,3 +160,525 @@ class Polyhedron:
       len(self.verts), len(self.edges),
       array(self.verts[self.edges], 'f')
     )
+
+# 多角形の集合
+class Polygons:
+  def __init__(self, verts, offsets, ids=None):
+    '''
+    * self.verts:
+      全ての多角形の頂点を連結した配列
+      Concatenated array of vertices of all polygons
+    * self.offsets:
+      各多角形の頂点の開始位置 (多角形の数+1)
+      Start index of vertices of each polygon (number of polygons+1)
+    * self.ids:
+      各多角形の元の番号
+      Source index of each polygon
+    '''
+    self.verts = np.asarray(verts)
+    self.offsets = np.asarray(offsets, 'i8')
+    self.ids = np.arange(len(self.offsets)-1) if ids is None else np.asarray(ids)
+  @classmethod
+  def concat(cls, polyss):
+    '''
+    複数の多角形の集合を連結する
+    Concatenate sets of polygons
+    '''
+    offsets, n = [np.zeros(1, 'i8')], 0
+    for polys in polyss:
+      offsets.append(polys.offsets[1:]+n)
+      n += len(polys.verts)
+    return cls(
+      np.concatenate([polys.verts for polys in polyss]),
+      np.concatenate(offsets),
+      np.concatenate([polys.ids for polys in polyss]),
+    )
+  def take(self, idx):
+    '''
+    番号idxの多角形だけを取り出す
+    Take polygons of the indices
+    '''
+    idx = np.asarray(idx, 'i8')
+    counts = self.counts[idx]
+    starts = np.cumsum(counts)-counts
+    jV = np.repeat(self.offsets[idx]-starts, counts)+np.arange(counts.sum())
+    return Polygons(self.verts[jV], np.concatenate([[0], np.cumsum(counts)]), self.ids[idx])
+  def __len__(self):
+    return len(self.offsets)-1
+  def __getitem__(self, i):
+    return Polygon(self.verts[self.offsets[i]:self.offsets[i+1]])
+  @property # getter
+  def counts(self):
+    '''
+    各多角形の頂点数
+    Number of vertices of each polygon
+    '''
+    return np.diff(self.offsets)
+  @property # getter
+  def owners(self):
+    '''
+    各頂点が属する多角形の番号
+    Index of the polygon that each vertex belongs to
+    '''
+    return np.repeat(np.arange(len(self)), self.counts)
+  def project(self, axes):
+    '''
+    座標軸axesに射影した多角形の集合を返す
+    Return polygons projected on the axes
+    '''
+    return Polygons(self.verts[:,axes], self.offsets, self.ids)
+  def clipLine(self, p, n, c=0, keepEmpty=False):
+    '''
+    各多角形と半平面 (x-p)・n >= c との共通部分を返す (Sutherland–Hodgman)
+    Return intersection of each polygon with half plane (x-p)・n >= c (Sutherland–Hodgman)
+    * p, n:
+      (D,) または多角形ごとの (P, D)
+      (D,) or (P, D) for each polygon
+    * c:
+      スカラーまたは多角形ごとの (P,)
+      Scalar or (P,) for each polygon
+    * keepEmpty:
+      共通部分が空の多角形を残すか (残さない場合はidsで元の番号が分かる)
+      Whether to keep polygons with empty intersection
+      (otherwise the source indices are kept in ids)
+    * returns: Polygons
+    '''
+    owners = self.owners
+    p = np.asarray(p, 'd')
+    n = np.asarray(n, 'd')
+    c = np.asarray(c, 'd')
+    if p.ndim == 2: p = p[owners]
+    if n.ndim == 2: n = n[owners]
+    if c.ndim == 1: c = c[owners]
+    r = np.sum((self.verts-p)*n, axis=-1)-c
+    # previous vertex of each vertex in its polygon
+    prev = np.arange(len(self.verts))-1
+    starts = self.offsets[:-1][self.counts > 0]
+    prev[starts] = self.offsets[1:][self.counts > 0]-1
+    r0, r1 = r[prev], r
+    in1 = r1 >= 0
+    cross = in1 != (r0 >= 0)
+    # each vertex outputs (intersection with the line if crossing, itself if inside)
+    nOut = cross.astype('i8')+in1
+    outStarts = np.cumsum(nOut)-nOut
+    verts = np.empty((nOut.sum(),)+self.verts.shape[1:])
+    iC = np.nonzero(cross)[0]
+    v0, v1 = self.verts[prev[iC]], self.verts[iC]
+    rc0, rc1 = r0[iC,None], r1[iC,None]
+    verts[outStarts[iC]] = (rc1*v0-rc0*v1)/(rc1-rc0)
+    verts[(outStarts+cross)[in1]] = self.verts[in1]
+    offsets = np.zeros(len(self)+1, 'i8')
+    np.cumsum(np.bincount(owners, nOut, minlength=len(self)).astype('i8'), out=offsets[1:])
+    ans = Polygons(verts, offsets, self.ids)
+    if keepEmpty: return ans
+    return ans.take(np.nonzero(ans.counts > 0)[0])
+  def clipHalfPlanes(self, ps, ns, cs=0):
+    '''
+    各多角形と複数の半平面 (x-ps[k])・ns[k] >= cs[k] との共通部分を返す
+    共通部分が空の多角形は除く
+    Return intersection of each polygon with half planes (x-ps[k])・ns[k] >= cs[k].
+    Polygons with empty intersection are dropped
+    * ps, ns: (K, D)
+    * cs: (K,) or scalar
+    * returns: Polygons
+    '''
+    ns = np.asarray(ns, 'd')
+    ps = np.asarray(ps, 'd').reshape(ns.shape)
+    cs = np.broadcast_to(np.asarray(cs, 'd'), len(ns))
+    ans = self
+    for p, n, c in zip(ps, ns, cs):
+      ans = ans.clipLine(p, n, c, keepEmpty=True)
+    return ans.take(np.nonzero(ans.counts > 0)[0])
+  def clipRect(self, lo, hi):
+    '''
+    各多角形と矩形 [lo, hi] との共通部分を返す
+    Return intersection of each polygon with rectangle [lo, hi]
+    '''
+    lo, hi = np.asarray(lo, 'd'), np.asarray(hi, 'd')
+    return self.clipHalfPlanes([lo, lo, hi, hi], [(1, 0), (0, 1), (-1, 0), (0, -1)])
+  def intersect(self, other, I, J):
+    '''
+    凸多角形の組 self[I[k]] ∩ other[J[k]] を返す
+    Return intersections of pairs of convex polygons self[I[k]] ∩ other[J[k]]
+    * other: Polygons (2D, convex)
+    * I, J: (K,)
+    * returns: Polygons
+      ids: k (index of the pair); empty intersections are dropped
+    '''
+    A = self.take(I)
+    A.ids = np.arange(len(A))
+    B = other.take(J)
+    counts = B.counts
+    base = B.offsets[:-1]
+    # signed area of each clipper (orientation)
+    x, y = B.verts[:,0], B.verts[:,1]
+    nxt = np.arange(len(B.verts))+1
+    nxt[B.offsets[1:][counts > 0]-1] = base[counts > 0]
+    area = np.bincount(B.owners, x*y[nxt]-x[nxt]*y, minlength=len(B))
+    sign = np.where(area < 0, -1.0, 1.0)[:,None]
+    for k in range(counts.max() if len(counts) else 0):
+      valid = k < counts
+      # (empty clippers read any vertex)
+      i0 = base+np.minimum(k, counts-1).clip(0)
+      i1 = base+(k+1)%np.maximum(counts, 1)
+      v0 = B.verts[i0.clip(None, len(B.verts)-1)]
+      v1 = B.verts[i1.clip(None, len(B.verts)-1)]
+      d = v1-v0
+      n = sign*np.stack([-d[:,1], d[:,0]], axis=1)
+      # edges beyond the clipper keep everything
+      n[~valid] = 0
+      c = np.where(valid, 0.0, -1.0)
+      A = A.clipLine(v0, n, c, keepEmpty=True)
+    # empty clippers keep nothing
+    A = A.take(np.nonzero((A.counts > 0) & (counts > 0))[0])
+    return A
+  def padded(self):
+    '''
+    最後の頂点を繰り返して(多角形の数, 最大頂点数, 次元)の配列にする
+    Return array of (number of polygons, max number of vertices, dimension)
+    padded by repeating the last vertex
+    '''
+    counts = self.counts
+    if len(counts) == 0: return self.verts[:0, None]
+    j = np.arange(counts.max())
+    idx = self.offsets[:-1,None]+np.minimum(j, counts[:,None]-1)
+    return self.verts[idx]
+  def __repr__(self):
+    return 'Polygons with %d polygons and %d vertices'%(len(self), len(self.verts))
+
+# 多面体の集合
+class Polyhedra:
+  def __init__(self, verts, edges, vOffsets, eOffsets):
+    '''
+    * self.verts:
+      全ての多面体の頂点を連結した配列
+      Concatenated array of vertices of all polyhedra
+    * self.edges:
+      全ての多面体の辺(self.vertsにおける2頂点の番号)を連結した配列
+      Concatenated array of edges (indices of 2 vertices in self.verts)
+    * self.vOffsets, self.eOffsets:
+      各多面体の頂点・辺の開始位置 (多面体の数+1)
+      Start index of vertices/edges of each polyhedron (number of polyhedra+1)
+    '''
+    self.verts = np.asarray(verts, 'd').reshape(-1, 3)
+    self.edges = np.asarray(edges, 'i8').reshape(-1, 2)
+    self.vOffsets = np.asarray(vOffsets, 'i8')
+    self.eOffsets = np.asarray(eOffsets, 'i8')
+  @classmethod
+  def fromPacked(cls, verts, edges):
+    '''
+    (N, V, 3)の頂点と(N, E, 2)の辺から作る。始点と終点が同じ辺は除く
+    Make from vertices (N, V, 3) and edges (N, E, 2).
+    Edges whose two ends are the same are dropped
+    '''
+    verts = np.asarray(verts, 'd')
+    edges = np.asarray(edges, 'i8')
+    N, V = verts.shape[:2]
+    edges = edges+(np.arange(N)*V)[:,None,None]
+    valid = edges[...,0] != edges[...,1]
+    eOffsets = np.zeros(N+1, 'i8')
+    np.cumsum(valid.sum(axis=1), out=eOffsets[1:])
+    return cls(verts, edges[valid], np.arange(N+1)*V, eOffsets)
+  @classmethod
+  def fromList(cls, polys):
+    '''
+    Polyhedronのリストから作る
+    Make from list of Polyhedron
+    '''
+    nV = [len(poly.verts) for poly in polys]
+    nE = [len(poly.edges) for poly in polys]
+    vOffsets = np.concatenate([[0], np.cumsum(nV)]).astype('i8')
+    eOffsets = np.concatenate([[0], np.cumsum(nE)]).astype('i8')
+    return cls(
+      np.concatenate([poly.verts for poly in polys]) if len(polys) else np.zeros((0, 3)),
+      np.concatenate([
+        poly.edges.reshape(-1, 2)+off
+        for poly, off in zip(polys, vOffsets)
+      ]) if len(polys) else np.zeros((0, 2), 'i8'),
+      vOffsets, eOffsets,
+    )
+  def __len__(self):
+    return len(self.vOffsets)-1
+  def __getitem__(self, i):
+    v0, v1 = self.vOffsets[i:i+2]
+    e0, e1 = self.eOffsets[i:i+2]
+    return Polyhedron(self.verts[v0:v1], self.edges[e0:e1]-v0)
+  @property # getter
+  def vertOwners(self):
+    '''
+    各頂点が属する多面体の番号
+    Index of the polyhedron that each vertex belongs to
+    '''
+    return np.repeat(np.arange(len(self)), np.diff(self.vOffsets))
+  @property # getter
+  def edgeOwners(self):
+    '''
+    各辺が属する多面体の番号
+    Index of the polyhedron that each edge belongs to
+    '''
+    return np.repeat(np.arange(len(self)), np.diff(self.eOffsets))
+  def clipPlane(self, p, n, c=0):
+    '''
+    各多面体と半空間 (x-p)・n >= c との共通部分を返す
+    共通部分が空の多面体は頂点も辺もない多面体になる
+    Return intersection of each polyhedron with half space (x-p)・n >= c.
+    Polyhedra with empty intersection have no vertices and edges
+    * p:
+      平面上の一点
+      Any point on the plane
+    * n:
+      平面の法線ベクトル
+      Normal vector of the plane
+    * c:
+      定数
+      Constant
+    * returns: Polyhedra
+      各多面体の頂点は(残った頂点, 新しい面の頂点(CCW))の順
+      Vertices of each polyhedron are (remaining vertices, vertices of the new face (CCW))
+    '''
+    p = array(p, 'd')
+    n = array(n, 'd')
+    N = len(self)
+    r = np.dot(self.verts-p, n)-c
+    inside = r >= 0
+    vOwners = self.vertOwners
+    eOwners = self.edgeOwners
+    ein = inside[self.edges]
+    cross = ein[:,0] != ein[:,1]
+    # number of remaining/new vertices of each polyhedron
+    nKeep = np.bincount(vOwners[inside], minlength=N)
+    nCap = np.bincount(eOwners[cross], minlength=N)
+    vOffsets = np.zeros(N+1, 'i8')
+    np.cumsum(nKeep+nCap, out=vOffsets[1:])
+    # map vertex indices old to new
+    keepOffsets = np.cumsum(nKeep)-nKeep
+    io2n = np.cumsum(inside)-1
+    io2n += vOffsets[vOwners]-keepOffsets[vOwners]
+    # new vertices on the plane
+    iCross = np.nonzero(cross)[0]
+    ec = self.edges[iCross]
+    cOwners = eOwners[iCross] # sorted
+    vv = self.verts[ec]
+    rr = np.abs(r[ec])
+    vNews = ((vv[:,0]*rr[:,1,None])+(vv[:,1]*rr[:,0,None]))/rr.sum(axis=1)[:,None]
+    ## sort CCW in each new face with basis {e1, e2} of the plane
+    capStarts = np.cumsum(nCap)-nCap
+    centers = np.zeros((N, 3))
+    np.add.at(centers, cOwners, vNews)
+    centers /= np.maximum(nCap, 1)[:,None]
+    e1 = normalize(np.cross(n, np.eye(3)[np.abs(n).argmin()]))
+    e2 = normalize(np.cross(n, e1))
+    cNews = np.dot(vNews-centers[cOwners], array([e1, e2]).transpose())
+    jNews = np.lexsort((np.arctan2(cNews[:,0], cNews[:,1]), cOwners))
+    rank = np.empty(len(jNews), 'i8')
+    rank[jNews] = np.arange(len(jNews))-capStarts[cOwners[jNews]]
+    iNews = vOffsets[cOwners]+nKeep[cOwners]+rank
+    # vertices
+    verts = np.empty((vOffsets[-1], 3))
+    verts[io2n[inside]] = self.verts[inside]
+    verts[iNews] = vNews
+    # edges: remaining edges, cut edges, and edges of the new faces
+    iOld = np.nonzero(ein.all(axis=1) | cross)[0]
+    edgesOld = io2n[self.edges[iOld]]
+    jCut = np.searchsorted(iOld, iCross)
+    edgesOld[jCut] = np.stack([
+      np.where(ein[iCross,0], edgesOld[jCut,0], edgesOld[jCut,1]),
+      iNews,
+    ], axis=1)
+    ## ring of new vertices (polyhedra with 3+ new vertices)
+    ring = nCap[cOwners[jNews]] >= 3
+    jRing = jNews[ring]
+    rOwners = cOwners[jRing]
+    prev = np.arange(len(jRing))-1
+    first = np.concatenate([[True], rOwners[1:] != rOwners[:-1]]) if len(jRing) else np.zeros(0, bool)
+    # the previous vertex of the first vertex is the last vertex
+    last = np.concatenate([np.nonzero(first)[0][1:]-1, [len(jRing)-1]]) if len(jRing) else np.zeros(0, 'i8')
+    prev[first] = last
+    edgesRing = np.stack([iNews[jRing[prev]], iNews[jRing]], axis=1).reshape(-1, 2)
+    owners = np.concatenate([eOwners[iOld], rOwners])
+    order = np.argsort(owners, kind='stable')
+    eOffsets = np.zeros(N+1, 'i8')
+    np.cumsum(np.bincount(owners, minlength=N), out=eOffsets[1:])
+    return Polyhedra(verts, np.concatenate([edgesOld, edgesRing])[order], vOffsets, eOffsets)
+  def clipHalfSpaces(self, ps, ns, cs=0):
+    '''
+    各多面体と複数の半空間 (x-ps[k])・ns[k] >= cs[k] との共通部分を返す
+    例えばy0 <= y <= y1 は ps=[(0, y0, 0), (0, y1, 0)], ns=[(0, 1, 0), (0, -1, 0)]
+    Return intersection of each polyhedron with half spaces (x-ps[k])・ns[k] >= cs[k].
+    e.g. y0 <= y <= y1 is ps=[(0, y0, 0), (0, y1, 0)], ns=[(0, 1, 0), (0, -1, 0)]
+    * ps, ns: (K, 3)
+    * cs: (K,) or scalar
+    * returns: Polyhedra
+    '''
+    ps = np.asarray(ps, 'd').reshape(-1, 3)
+    ns = np.asarray(ns, 'd').reshape(-1, 3)
+    cs = np.broadcast_to(np.asarray(cs, 'd'), len(ns))
+    ans = self
+    for p, n, c in zip(ps, ns, cs):
+      ans = ans.clipPlane(p, n, c)
+    return ans
+  def slicePlane(self, p, n):
+    '''
+    各多面体と平面 (x-p)･n=0 との共通部分(多角形)を返す
+    共通部分が空の多面体は除く
+    Return intersections(polygons) of each polyhedron with plane (x-p)･n=0.
+    Polyhedra with empty intersection are dropped
+    * p:
+      平面上の一点
+      Any point on the plane
+    * n:
+      平面の法線ベクトル
+      Normal vector of the plane
+    * returns: Polygons
+      ids: indices of the polyhedra
+    '''
+    return self.slicePlanes(p, n, [0])[0]
+  def slicePlanes(self, p, n, offsets):
+    '''
+    各多面体と平行な複数の平面 (x-p)･n=offsets[k] との共通部分(多角形)を返す
+    頂点の射影と辺の範囲は全ての平面で共有する
+    Return intersections(polygons) of each polyhedron
+    with parallel planes (x-p)･n=offsets[k].
+    Projections of vertices and ranges of edges are shared by all planes
+    * p:
+      平面上の一点
+      Any point on the plane
+    * n:
+      平面の法線ベクトル
+      Normal vector of the plane
+    * offsets: (K,)
+    * returns: [Polygons] of each plane
+      ids: indices of the polyhedra
+    '''
+    p = array(p, 'd')
+    n = array(n, 'd')
+    offsets = np.asarray(offsets, 'd').reshape(-1)
+    N = len(self)
+    # shared by all planes: edges which may cross any plane (ends on a plane count unless both)
+    d = np.dot(self.verts-p, n)
+    de = d[self.edges]
+    lo, hi = np.minimum(de[:,0], de[:,1]), np.maximum(de[:,0], de[:,1])
+    iC = np.nonzero((lo < hi) & (hi >= offsets.min(initial=np.inf)) & (lo <= offsets.max(initial=-np.inf)))[0]
+    lo, hi = lo[iC], hi[iC]
+    d0 = de[iC,0]
+    dd = de[iC,1]-d0
+    v0 = self.verts[self.edges[iC,0]]
+    dv = self.verts[self.edges[iC,1]]-v0
+    owners = self.edgeOwners[iC] # sorted
+    # crossing edges of each plane
+    js = [np.nonzero((lo <= h) & (h <= hi))[0] for h in offsets.tolist()]
+    planeCounts = [len(j) for j in js]
+    j = np.concatenate(js) if len(js) else np.zeros(0, 'i8')
+    k = np.repeat(np.arange(len(offsets)), planeCounts)
+    t = (offsets[k]-d0[j])/dd[j]
+    vNews = v0[j]+t[:,None]*dv[j]
+    # group by (plane, polyhedron)
+    groups = k*N+owners[j]
+    starts = np.nonzero(np.concatenate([[True], groups[1:] != groups[:-1]]))[0] if len(groups) else np.zeros(0, 'i8')
+    keys = groups[starts]
+    counts = np.diff(np.append(starts, len(groups)))
+    if len(vNews):
+      # sort CCW in each polygon with basis {e1, e2} of the plane
+      e1 = normalize(np.cross(n, np.eye(3)[np.abs(n).argmin()]))
+      e2 = normalize(np.cross(n, e1))
+      cNews = np.dot(vNews, array([e1, e2]).transpose())
+      cNews -= np.repeat(np.add.reduceat(cNews, starts)/counts[:,None], counts, axis=0)
+      angle = np.arctan2(cNews[:,0], cNews[:,1])
+      ## sort in each polygon (padded to the max number of vertices)
+      jV = np.arange(counts.max())
+      valid = jV < counts[:,None]
+      idx = starts[:,None]+np.minimum(jV, counts[:,None]-1)
+      jSort = np.argsort(np.where(valid, angle[idx], np.inf), axis=1, kind='stable')
+      vNews = vNews[np.take_along_axis(idx, jSort, axis=1)[valid]]
+    # split by plane
+    bounds = np.searchsorted(keys//N if N else keys, np.arange(len(offsets)+1))
+    vBounds = np.append(starts, len(vNews))[bounds]
+    return [
+      Polygons(
+        vNews[vBounds[kk]:vBounds[kk+1]],
+        np.append(starts[g0:g1], vBounds[kk+1])-vBounds[kk],
+        keys[g0:g1]-kk*N,
+      )
+      for kk, (g0, g1) in enumerate(zip(bounds[:-1], bounds[1:]))
+    ]
+  def __repr__(self):
+    return 'Polyhedra with %d polyhedra, %d vertices and %d edges'%(
+      len(self), len(self.verts), len(self.edges),
+    )
+
+# AABBの一様格子
+class AABBGrid:
+  def __init__(self, mins, maxs, cellSize=1024, axes=(0, 2)):
+    '''
+    AABBの集合を2軸の一様格子に登録する
+    Register AABBs in a uniform grid of 2 axes
+    * mins, maxs:
+      各AABBの最小・最大の座標 (N, 3)
+      Min/max coordinates of each AABB (N, 3)
+    * cellSize:
+      格子の大きさ
+      Size of each cell
+    * axes:
+      格子の2軸
+      2 axes of the grid
+    '''
+    self.mins = np.asarray(mins, 'd').reshape(-1, 3)
+    self.maxs = np.asarray(maxs, 'd').reshape(-1, 3)
+    self.cellSize = cellSize
+    self.axes = list(axes)
+    N = len(self.mins)
+    lo = self.cellOf(self.mins)
+    hi = self.cellOf(self.maxs)
+    self.origin = lo.min(axis=0) if N else np.zeros(2, 'i8')
+    self.shape = (hi.max(axis=0)-self.origin+1) if N else np.zeros(2, 'i8')
+    lo -= self.origin
+    hi -= self.origin
+    # register each AABB in all cells it overlaps
+    span = hi-lo+1
+    counts = span.prod(axis=1)
+    ids = np.repeat(np.arange(N), counts)
+    k = np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts, counts)
+    c0 = lo[ids,0]+k//span[ids,1]
+    c1 = lo[ids,1]+k%span[ids,1]
+    cells = c0*self.shape[1]+c1
+    order = np.argsort(cells, kind='stable')
+    self.items = ids[order]
+    self.starts = np.searchsorted(cells[order], np.arange(self.shape.prod()+1))
+  def cellOf(self, ps):
+    return np.floor(np.asarray(ps)[...,self.axes]/self.cellSize).astype('i8')
+  def __len__(self):
+    return len(self.mins)
+  def queryBox(self, lo, hi):
+    '''
+    箱 [lo, hi] と重なるAABBの番号を返す
+    Return indices of AABBs overlapping the box [lo, hi]
+    '''
+    lo, hi = np.asarray(lo, 'd'), np.asarray(hi, 'd')
+    if len(self) == 0: return np.zeros(0, 'i8')
+    c0 = np.clip(self.cellOf(lo)-self.origin, 0, self.shape-1)
+    c1 = np.clip(self.cellOf(hi)-self.origin, 0, self.shape-1)
+    ids = np.unique(np.concatenate([
+      self.items[self.starts[i*self.shape[1]+c0[1]]:self.starts[i*self.shape[1]+c1[1]+1]]
+      for i in range(c0[0], c1[0]+1)
+    ]))
+    hit = np.all((self.mins[ids] <= hi) & (self.maxs[ids] >= lo), axis=1)
+    return ids[hit]
+  def queryPoints(self, ps):
+    '''
+    各点を含むAABBの番号の組を返す
+    Return pairs of (index of point, index of AABB) where the AABB contains the point
+    * ps: (M, 3)
+    '''
+    ps = np.asarray(ps, 'd').reshape(-1, 3)
+    if len(self) == 0: return np.zeros(0, 'i8'), np.zeros(0, 'i8')
+    c = self.cellOf(ps)-self.origin
+    inside = np.all((c >= 0) & (c < self.shape), axis=1)
+    cell = np.where(inside, c[:,0]*self.shape[1]+c[:,1], 0)
+    s0 = self.starts[cell]
+    counts = np.where(inside, self.starts[cell+1]-s0, 0)
+    iP = np.repeat(np.arange(len(ps)), counts)
+    iA = self.items[np.repeat(s0-np.cumsum(counts)+counts, counts)+np.arange(counts.sum())]
+    hit = np.all((self.mins[iA] <= ps[iP]) & (self.maxs[iA] >= ps[iP]), axis=1)
+    return iP[hit], iA[hit]
+  def __repr__(self):
+    return 'AABBGrid with %d AABBs in %dx%d cells'%(len(self), *self.shape)
@@ -0,0 +1,89 @@
+# SPDX-License-Identifier: GPL-3.0-only
+# Copyright (c) 2022 sup39
+
+import os
+import numpy as np
+from types import SimpleNamespace
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from .SMS import SMSDolphin, MEM1_SIZE
+from .pipeline import WFCCache, compute_frame
+
+# state of each worker process
+_worker = None
+
+def _init_worker(shmName, params):
+  global _worker
+  # the parent process owns (and unlinks) the shared memory
+  shm = shared_memory.SharedMemory(name=shmName)
+  d = SMSDolphin()
+  err = d.attach(SimpleNamespace(buf=shm.buf))
+  if err is not None: raise RuntimeError(err)
+  _worker = SimpleNamespace(shm=shm, d=d, cache=WFCCache(), params=params)
+
+def _compute_chunk(chunk):
+  w = _worker
+  return [
+    compute_frame(w.d, w.params, w.cache, pos=pos, planes=planes)
+    for pos, planes in zip(*chunk)
+  ]
+
+def isPlane(x):
+  '''
+  xが(法線ベクトル, 軸)か
+  Whether x is (normal vector, axes)
+  '''
+  return len(x) == 2 and len(x[0]) == 3
+
+def sweep_frames(d, positions, params, planes=None, workers=None, chunkSize=None):
+  '''
+  複数の位置でWFCを計算する
+  独立した位置はプロセスプールで並列に計算し、MEM1は共有メモリで渡す
+  Compute WFC at many positions.
+  Independent positions are computed in parallel by a process pool,
+  and MEM1 is passed by shared memory
+  * d: SMSDolphin (hooked or attached)
+  * positions: (M, 3)
+  * params: WFCParams
+  * planes:
+    全ての位置で使う[(法線ベクトル, 軸)]、または位置ごとのそのリスト(長さM)
+    (Noneならdefault_planes())
+    [(normal vector, axes)] used at all positions, or a list (of length M) of them for each position
+    (default_planes() if None)
+  * workers:
+    プロセス数 (Noneならos.cpu_count()、1以下ならこのプロセスで計算する)
+    Number of processes (os.cpu_count() if None, computed in this process if <= 1)
+  * chunkSize:
+    1回のタスクの位置の数 (近い位置はキャッシュを共有できるように連続で渡す)
+    Number of positions per task (consecutive positions share cache)
+  * returns: [WFCFrame] of each position
+  '''
+  positions = np.asarray(positions, 'd').reshape(-1, 3)
+  # planes of each position
+  if planes is None or not len(planes) or isPlane(planes[0]):
+    planess = [planes]*len(positions)
+  else:
+    planess = list(planes)
+    if len(planess) != len(positions):
+      raise ValueError('Got planes of %d positions for %d positions'%(len(planess), len(positions)))
+  if workers is None: workers = os.cpu_count() or 1
+  workers = min(workers, len(positions))
+  if workers <= 1:
+    cache = WFCCache()
+    return [compute_frame(d, params, cache, pos=pos, planes=planes) for pos, planes in zip(positions, planess)]
+  if chunkSize is None: chunkSize = max(1, -(-len(positions)//(4*workers)))
+  chunks = [
+    (positions[i:i+chunkSize], planess[i:i+chunkSize])
+    for i in range(0, len(positions), chunkSize)
+  ]
+  # snapshot of MEM1 shared by all workers
+  shm = shared_memory.SharedMemory(create=True, size=MEM1_SIZE)
+  try:
+    shm.buf[:MEM1_SIZE] = d.memory.buf[:MEM1_SIZE]
+    with ProcessPoolExecutor(
+      workers, initializer=_init_worker, initargs=(shm.name, params),
+    ) as pool:
+      return [frame for frames in pool.map(_compute_chunk, chunks) for frame in frames]
+  finally:
+    shm.close()
+    shm.unlink()
@@ -0,0 +1,164 @@
+# SPDX-License-Identifier: GPL-3.0-only
+# Copyright (c) 2022 sup39
+
+import json
+import threading
+from time import perf_counter
+import numpy as np
+from contextlib import nullcontext
+
+# stages of a frame, in the order of a frame
+STAGES = ('pointer', 'collision', 'hitbox', 'slice', 'arrow', 'compute_frame', 'draw')
+NULL_SPAN = nullcontext()
+
+class Span:
+  '''
+  区間の時間を測る (入れ子の区間の時間は除く)
+  Measure time of a span (excluding time of nested spans)
+  '''
+  __slots__ = ('profiler', 'name', 't0', 'child', 'parent')
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+  def __enter__(self):
+    local = self.profiler.local
+    self.child = 0
+    self.parent = getattr(local, 'span', None)
+    local.span = self
+    self.t0 = perf_counter()
+    return self
+  def __exit__(self, *args):
+    dt = perf_counter()-self.t0
+    self.profiler.local.span = self.parent
+    if self.parent is not None: self.parent.child += dt
+    self.profiler.add(self.name, dt-self.child)
+
+class FrameSpan:
+  '''
+  1フレームの区間の時間をまとめてリングバッファに入れる
+  Put total time of the spans in a frame into the ring buffers
+  '''
+  __slots__ = ('profiler', 'name', 't0', 'outer')
+  def __init__(self, profiler, name):
+    self.profiler = profiler
+    self.name = name
+  def __enter__(self):
+    local = self.profiler.local
+    self.outer = getattr(local, 'totals', None)
+    if self.outer is None: local.totals = {}
+    self.t0 = perf_counter()
+    return self
+  def __exit__(self, *args):
+    dt = perf_counter()-self.t0
+    if self.outer is not None: return
+    local = self.profiler.local
+    totals, local.totals = local.totals, None
+    totals[self.name] = dt
+    self.profiler.push(totals)
+
+class Profiler:
+  '''
+  段階ごとの1フレームの時間を固定長のリングバッファに記録する
+  無効な時はspan()が何もしないコンテキストを返すだけ
+  Record time of each stage per frame in fixed-size ring buffers.
+  When disabled, span() only returns a context doing nothing
+  * size: number of frames kept for each stage
+  '''
+  def __init__(self, size=512):
+    self.enabled = False
+    self.size = size
+    self.local = threading.local()
+    self.lock = threading.Lock()
+    self.clear()
+  def clear(self):
+    with self.lock:
+      self.rings = {}
+      self.counts = {}
+  def setEnabled(self, val):
+    self.enabled = bool(val)
+  def span(self, name):
+    '''
+    with文で区間を測る
+    Measure a span with `with` statement
+    '''
+    return Span(self, name) if self.enabled else NULL_SPAN
+  def frame(self, name):
+    '''
+    with文で1フレームを測る。中の区間の時間はフレームごとに合計される
+    Measure a frame with `with` statement.
+    Time of spans inside is summed up per frame
+    '''
+    return FrameSpan(self, name) if self.enabled else NULL_SPAN
+  def add(self, name, dt):
+    totals = getattr(self.local, 'totals', None)
+    # spans outside frames are a frame by themselves
+    if totals is None: return self.push({name: dt})
+    totals[name] = totals.get(name, 0)+dt
+  def push(self, totals):
+    with self.lock:
+      for name, dt in totals.items():
+        ring = self.rings.get(name)
+        if ring is None:
+          ring = self.rings[name] = np.zeros(self.size)
+          self.counts[name] = 0
+        ring[self.counts[name]%self.size] = dt
+        self.counts[name] += 1
+  def samples(self, name):
+    '''
+    古い順の記録(秒)
+    Recorded time (seconds) from oldest to newest
+    '''
+    with self.lock:
+      ring, count = self.rings[name], self.counts[name]
+      if count <= self.size: return ring[:count].copy()
+      return np.roll(ring, -(count%self.size))
+  def names(self):
+    with self.lock:
+      names = list(self.rings)
+    return sorted(names, key=lambda name: (STAGES.index(name) if name in STAGES else len(STAGES), name))
+  def stats(self):
+    '''
+    各段階の{count, p50, p95, max} (ミリ秒)
+    {count, p50, p95, max} (milliseconds) of each stage
+    '''
+    ans = {}
+    for name in self.names():
+      t = self.samples(name)*1000
+      p50, p95 = np.percentile(t, [50, 95])
+      ans[name] = {'count': self.counts[name], 'p50': p50, 'p95': p95, 'max': t.max()}
+    return ans
+  def format(self):
+    '''
+    statsの表
+    Table of stats
+    '''
+    return '\n'.join([
+      '%-14s %7s %7s %7s'%('ms', 'p50', 'p95', 'max'),
+    ]+[
+      '%-14s %7.2f %7.2f %7.2f'%(name, s['p50'], s['p95'], s['max'])
+      for name, s in self.stats().items()
+    ])
+  def export(self, path):
+    '''
+    statsと記録を拡張子に応じてJSON/CSVに保存する
+    Save stats and records as JSON/CSV according to the extension
+    '''
+    names = self.names()
+    if path.lower().endswith('.csv'):
+      # a column of time (ms) of each stage
+      columns = [self.samples(name)*1000 for name in names]
+      with open(path, 'w') as f:
+        f.write(','.join(names)+'\n')
+        for i in range(max(map(len, columns), default=0)):
+          f.write(','.join('%.4f'%c[i] if i < len(c) else '' for c in columns)+'\n')
+    else:
+      with open(path, 'w') as f:
+        json.dump({
+          'stats': self.stats(),
+          'samples': {name: (self.samples(name)*1000).tolist() for name in names},
+        }, f, indent=1)
+
+# profiler of WFC frames
+PROFILER = Profiler()
+def span(name):
+  return PROFILER.span(name)